@@ -14,13 +14,15 @@ Sources:
 import cv2
 import os
 import numpy as np
-from process_images import face_check, process_images
-from landmark_map import find_landmarks
-from scale import scale_images, scale_landmarks
+from ingest import ingest_images, iter_images
+from scale import eye_transforms, scale_images, iter_scaled_images, scale_landmarks
 from transform import calculateDelaunayTriangles, warpTriangle, image_transform
+from progress import Progress
 
 
-def main(image_path):
+def main(image_path, output_path='static/outputimage/average_face.png', clear_inputs=True,
+         cache_path='landmark_cache.db', workers=1, stream=False, roi=False, min_face=0.1, progress=None,
+         detector='hog', boxes=None):
     """ Main runs the program to average the
     faces in a given file path, saving the
     averaged image in an output image file
@@ -31,42 +33,79 @@ def main(image_path):
     image_path: str
         A string indicating the filepath containing
         the images to be 'averaged'
+    output_path: str
+        The filepath the averaged image is saved to. Default
+        is 'static/outputimage/average_face.png'.
+    clear_inputs: bool
+        Whether the images in image_path are removed
+        afterwards. Default is True.
+    cache_path: str
+        The filepath of the landmark cache database, so that
+        faces found in earlier runs are not searched for again.
+        Default is 'landmark_cache.db'. Use None to disable it.
+    workers: int
+        The number of processes used to find faces and landmarks.
+        Default is 1.
+    stream: bool
+        If True, only the landmarks are kept after the first pass
+        and the images are then loaded, scaled and warped one at a
+        time, so memory use does not grow with the number of images.
+        Default is False.
+    roi: bool
+        If True, only the part of each image around the face that
+        ends up in the output is kept, as uint8 until it is warped.
+        Default is False.
+    min_face: float
+        The smallest face, as a fraction of the shorter side of
+        an image, looked for on a scaled down copy before the
+        detector falls back to upsampling. Default is 0.1. Use
+        None to always search the full resolution image.
+    progress: Progress
+        Reports each stage, and the images it has done, see
+        progress.Progress. Default is None, which only prints
+        the stages.
+    detector: str
+        The face detector, one of 'hog' (dlib, the default),
+        'haar' or 'lbp' (OpenCV's faster cascades) or 'boxes'.
+    boxes: dict
+        For the 'boxes' detector, the boxes of the faces in each
+        image, by file name, as lists of (left, top, right, bottom)
 
     **Returns**
 
     None
     """
+    if progress is None:
+        progress = Progress()
     print('Opening {} and checking for faces...'.format(image_path))
     print('Processing images...')
-    face_check(image_path)
-    images = process_images(image_path)
-    print('Finding facial landmarks...')
-    allandmarks = find_landmarks(image_path)
-    print('Scaling images to common space...')
-    scaled_images = scale_images(images, allandmarks)
-    pointsAvg, pointsNorm = scale_landmarks(images, allandmarks)
-    print('Triangulating points...')
+    progress.begin('landmarks', 'Finding facial landmarks...')
+    records = ingest_images(image_path, cache_path=cache_path, workers=workers,
+                            keep_pixels=not stream, roi=roi, min_face=min_face, progress=progress,
+                            detector=detector, boxes=boxes)
+    allandmarks = [record.landmarks for record in records]
+    progress.begin('scaling', 'Scaling images to common space...', len(records))
+    tforms = eye_transforms(allandmarks)
+    pointsAvg, pointsNorm = scale_landmarks(records, allandmarks, tforms)
+    if stream:
+        scaled_images = iter_scaled_images(iter_images(records), tforms)
+    else:
+        images = [record.image for record in records]
+        scaled_images = scale_images(images, allandmarks, tforms)
+    progress.begin('triangulating', 'Triangulating points...')
     dt = calculateDelaunayTriangles(np.array(pointsAvg))
-    print('Averaging faces...')
-    output = image_transform(scaled_images, pointsNorm, pointsAvg, dt)
+    progress.begin('averaging', 'Averaging faces...', len(records))
+    output = image_transform(scaled_images, pointsNorm, pointsAvg, dt, engine='remap', progress=progress)
     print('Success!')
     output = output*255
     output = output.astype('uint8')
-    cv2.imwrite('static/outputimage/average_face.png', output)
-    os.chdir('./static/faces')
-    for file in os.listdir('.'):
-        print(file)
-        if file.endswith('.jpg'):
-            os.remove(file)
-        elif file.endswith('.tiff'):
-            os.remove(file)
-        elif file.endswith('.jpeg'):
-            os.remove(file)
-        elif file.endswith('.png'):
-            os.remove(file)
-        else:
-            continue
-    os.chdir('../..')
-    
+    cv2.imwrite(output_path, output)
+    progress.finish()
+    if not clear_inputs:
+        return
+    for file in os.listdir(image_path):
+        if file.endswith(('.jpg', '.tiff', '.jpeg', '.png')):
+            os.remove(os.path.join(image_path, file))
+
 if __name__ == '__main__':
     main('./static/faces')
\ No newline at end of file
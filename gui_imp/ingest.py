@@ -0,0 +1,434 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# ingest.py
+'''
+This script takes care of the ingest stage of the
+averager.py program. Every image file is decoded once and
+run through the face detector once, and a record is kept
+for every face found so that the later stages never have
+to go back to the disk.
+Faces can be looked up in a LandmarkCache first, in which
+case dlib is not needed at all for that file.
+Detection can also be spread over a pool of worker processes.
+It contains eight functions:
+    ingest_images
+    ingest_file
+    detect_file
+    detect_bytes
+    find_faces
+    expand_faces
+    load_image
+    iter_images
+
+Sources:
+    http://dlib.net/face_landmark_detection.py.html
+    stack overflow
+'''
+import os
+import glob
+import multiprocessing
+from collections import namedtuple
+from functools import partial
+import cv2
+import numpy as np
+import dlib
+from models import get_predictor, warm
+from detect import detect_faces
+from landmark_cache import LandmarkCache, cache_key, model_identity
+from scale import face_region
+
+# One record per detected face. image is the decoded
+# float32 BGR image, box is (left, top, right, bottom) and
+# landmarks is a list of (x, y) tuples in image coordinates.
+# When only the region of interest around the face is kept,
+# region is its (left, top, right, bottom) in the file, image
+# is the uint8 crop and box and landmarks are relative to it.
+FaceRecord = namedtuple('FaceRecord', ['filename', 'image', 'box', 'landmarks', 'region'], defaults=(None,))
+
+
+def find_faces(image, predictorfp, min_face=0.1, detector='hog', boxes=None):
+    """find_faces runs the face detector and dlib's
+    shape predictor over a decoded image.
+
+    **Parameters**
+    image: numpy array
+        The decoded BGR image
+    predictorfp: str
+        The filepath name containing the predictor file
+    min_face: float
+        The smallest face looked for on the first, scaled
+        down, detection pass, see detect.detect_faces
+    detector: str
+        The face detector, see detect.DETECTORS. Default is 'hog'.
+    boxes: list
+        The boxes of the faces, for the 'boxes' detector
+
+    **Returns**
+    faces: list
+        A list of (box, landmarks) pairs, one for each face,
+        where box is (left, top, right, bottom) and landmarks
+        is a list of (x, y) tuples
+    """
+    predictor = get_predictor(predictorfp)
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    faces = []
+    for box in detect_faces(rgb, min_face, detector=detector, boxes=boxes):
+        shape = predictor(rgb, dlib.rectangle(*box))
+        landmarks = []
+        for point in range(0, shape.num_parts):
+            landmarks.append((int(shape.part(point).x), int(shape.part(point).y)))
+        faces.append((box, landmarks))
+    return faces
+
+
+def detect_bytes(data, predictorfp, cache=None, min_face=0.1, detector='hog', boxes=None):
+    """detect_bytes decodes an image held in memory, e.g.
+    one read straight from an upload, and finds the faces
+    in it, looking them up in the cache first if one is given.
+
+    **Parameters**
+    data: numpy array
+        The raw bytes of the image file, as a uint8 array
+    predictorfp: str
+        The filepath name containing the predictor file
+    cache: LandmarkCache
+        An optional cache to look the faces up in before
+        running dlib, and to store them in afterwards
+    min_face, detector, boxes:
+        See find_faces
+
+    **Returns**
+    image: numpy array
+        The decoded uint8 BGR image, or None if the bytes
+        could not be decoded
+    faces: list
+        A list of (box, landmarks) pairs, see find_faces
+    """
+    if not data.size:
+        return None, []
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if image is None:
+        return None, []
+    faces = None
+    if cache is not None:
+        key = cache_key(data, model_identity(predictorfp), upsample=1, min_face=min_face, detector=detector,
+                        boxes=boxes)
+        faces = cache.get(key)
+    if faces is None:
+        faces = find_faces(image, predictorfp, min_face, detector, boxes)
+        if cache is not None:
+            cache.put(key, faces)
+    return image, faces
+
+
+def detect_file(file, predictorfp, cache=None, min_face=0.1, detector='hog', boxes=None):
+    """detect_file decodes a single image file and finds
+    the faces in it, see detect_bytes.
+
+    **Parameters**
+    file: str
+        The filepath of the image
+    predictorfp: str
+        The filepath name containing the predictor file
+    cache: LandmarkCache
+        An optional cache to look the faces up in before
+        running dlib, and to store them in afterwards
+    min_face, detector, boxes:
+        See find_faces
+
+    **Returns**
+    image: numpy array
+        The decoded uint8 BGR image, or None if the file
+        could not be read or decoded
+    faces: list
+        A list of (box, landmarks) pairs, see find_faces
+    """
+    try:
+        data = np.fromfile(file, np.uint8)
+    except OSError:
+        # e.g. a folder, or a file removed since it was listed
+        return None, []
+    return detect_bytes(data, predictorfp, cache, min_face, detector, boxes)
+
+
+def ingest_file(file, predictorfp, cache=None, keep_pixels=True, roi=False, min_face=0.1,
+                detector='hog', boxes=None):
+    """ingest_file decodes a single image file,
+    detects the faces in it and finds the facial
+    landmarks of every face, all in one pass.
+
+    **Parameters**
+    file: str
+        The filepath of the image to ingest
+    predictorfp: str
+        The filepath name containing the predictor file
+    cache: LandmarkCache
+        An optional cache to look the faces up in before
+        running dlib, and to store them in afterwards
+    keep_pixels: bool
+        Whether the records hold the decoded image. If False
+        the image is None and can be loaded later with load_image.
+    roi: bool
+        Whether each record keeps only the region of interest
+        around its face, see face_region, as uint8.
+    min_face, detector, boxes:
+        See find_faces
+
+    **Returns**
+    records: list
+        A list of FaceRecords, one for each face found in
+        the image. The list is empty if the file could not
+        be decoded or no face was found.
+    """
+    image, faces = detect_file(file, predictorfp, cache, min_face, detector, boxes)
+    return expand_faces(file, image if keep_pixels else None, faces, roi)
+
+
+def expand_faces(file, image, faces, roi=False):
+    """expand_faces turns the faces found in an image
+    into one FaceRecord per face, all in memory. An image
+    with several faces gives several samples, each carrying
+    its own landmarks, so nothing has to be cropped out,
+    written back to disk and detected again.
+
+    **Parameters**
+    file: str
+        The filepath of the image
+    image: numpy array
+        The decoded uint8 BGR image, or None if the
+        pixels are not to be kept
+    faces: list
+        A list of (box, landmarks) pairs, see find_faces
+    roi: bool
+        Whether each record keeps only the region of interest
+        around its face, see face_region, as uint8. Default
+        is False, in which case the faces share one float32
+        copy of the image.
+
+    **Returns**
+    records: list
+        A list of FaceRecords, one for each face
+    """
+    records = []
+    pixels = None
+    for box, landmarks in faces:
+        if roi:
+            region = face_region(landmarks)
+            left, top = region[0], region[1]
+            box = (box[0] - left, box[1] - top, box[2] - left, box[3] - top)
+            landmarks = [(x - left, y - top) for x, y in landmarks]
+            crop = _crop(image, region) if image is not None else None
+            records.append(FaceRecord(file, crop, box, landmarks, region))
+            continue
+        if pixels is None and image is not None:
+            pixels = np.float32(image)/255.0
+        records.append(FaceRecord(file, pixels, box, landmarks))
+    return records
+
+
+def _crop(image, region):
+    """Copies a region out of an image, so that the
+    rest of the image can be freed"""
+    left, top, right, bottom = region
+    return image[top:bottom, left:right].copy()
+
+
+def load_image(record):
+    """load_image returns the pixels of a FaceRecord,
+    decoding its file again if they were not kept.
+
+    **Parameters**
+    record: FaceRecord
+        The record of the face
+
+    **Returns**
+    image: numpy array
+        The float32 BGR image the face was found in, or
+        the uint8 region of interest if the record has one.
+        None if the file can no longer be read, e.g. because
+        it was removed or replaced since its faces were found.
+    """
+    if record.image is not None:
+        return record.image
+    image = cv2.imread(record.filename)
+    if image is None:
+        print("'{}' could no longer be read, so its face is left out.".format(os.path.basename(record.filename)))
+        return None
+    if record.region is not None:
+        return _crop(image, record.region)
+    return np.float32(image)/255.0
+
+
+def iter_images(records):
+    """iter_images is a generator yielding the
+    pixels of each record in turn, so that only one
+    image needs to be held in memory at a time.
+
+    **Parameters**
+    records: list
+        A list of FaceRecords
+
+    **Returns**
+    image: numpy array
+        The image of each record, see load_image
+    """
+    for record in records:
+        yield load_image(record)
+
+
+# The landmark cache of an ingest worker process
+_worker = {}
+
+
+def _init_worker(predictorfp, cache_path, detector):
+    """Loads the models and opens the cache of an ingest worker"""
+    warm(predictorfp, detector)
+    _worker['cache'] = LandmarkCache(cache_path) if cache_path else None
+
+
+def _detect_worker(file, predictorfp, min_face, detector, boxes, keep_pixels, roi):
+    """Finds the faces of one file inside an ingest worker and
+    returns its FaceRecords. Regions of interest are cropped
+    here and sent back, but whole images are not, since
+    pickling them back to the parent costs more than decoding
+    them there.
+    """
+    image, faces = detect_file(file, predictorfp, _worker['cache'], min_face, detector,
+                               boxes.get(os.path.basename(file)) if boxes else None)
+    return expand_faces(file, image if keep_pixels and roi else None, faces, roi)
+
+
+def _ingest_parallel(files, predictorfp, cache_path, workers, chunksize, keep_pixels, roi, min_face,
+                     detector, boxes):
+    """Yields the FaceRecords of each file, with detection
+    and landmarking spread over a pool of worker processes.
+    Results come back in the order of files.
+    """
+    if chunksize is None:
+        chunksize = max(1, len(files) // (workers * 4))
+    with multiprocessing.Pool(workers, _init_worker, (predictorfp, cache_path, detector)) as pool:
+        found = pool.imap(partial(_detect_worker, predictorfp=predictorfp, min_face=min_face,
+                                  detector=detector, boxes=boxes, keep_pixels=keep_pixels, roi=roi),
+                          files, chunksize)
+        for file, records in zip(files, found):
+            if records and keep_pixels and not roi:
+                image = cv2.imread(file)
+                if image is None:
+                    # Changed or removed since the worker read it
+                    print("'{}' could no longer be read.".format(os.path.basename(file)))
+                    records = []
+                else:
+                    records = expand_faces(file, image, [(record.box, record.landmarks) for record in records])
+            yield records
+
+
+def ingest_images(imagesfp, predictorfp='shape_predictor_68_face_landmarks.dat', cache_path=None,
+                  workers=1, chunksize=None, keep_pixels=True, roi=False, min_face=0.1, progress=None,
+                  detector='hog', boxes=None, exit_if_few=True):
+    """ingest_images replaces the separate face_check,
+    process_images and find_landmarks passes. Each file in
+    the filepath is decoded and searched for faces exactly once.
+    Files without a face are left out of the average, and files
+    with more than one face give one record per face. If fewer
+    than two faces are found in total, it will exit the program.
+
+    **Parameters**
+    imagesfp: str
+        The name of the folder containing the images
+        to be averaged
+    predictorfp: str
+        The filepath name containing the predictor file. Default is
+        'shape_predictor_68_face_landmarks.dat'.
+    cache_path: str
+        The filepath of a landmark cache database. If given,
+        faces found in earlier runs are read from it instead
+        of running dlib again. Default is None (no cache).
+    workers: int
+        The number of processes to run detection and landmarking
+        in. Each loads its own predictor. Default is 1, which
+        runs everything in this process.
+    chunksize: int
+        The number of files handed to a worker at a time. Default
+        is None, which splits the files into about four chunks
+        per worker.
+    keep_pixels: bool
+        Whether the records hold the decoded images. Default is
+        True. If False only the faces are kept, and the images can
+        be streamed in again later with iter_images.
+    roi: bool
+        If True, each record keeps only the part of its image that
+        ends up in the output (see scale.face_region), and keeps it
+        as uint8, so the pixels are only converted to float when
+        they are warped. Default is False.
+    min_face: float
+        The smallest face looked for before the detector falls back
+        to upsampling, as a fraction of the shorter side of each
+        image. Default is 0.1. See detect.detect_faces.
+    progress: Progress
+        Told how many files are done after each one, see
+        progress.Progress. The number of images, the number of
+        faces, and how many images had each number of faces
+        are stored in its counts. Default is None.
+    detector: str
+        The face detector, see detect.DETECTORS. Default is 'hog'.
+    boxes: dict
+        The boxes of the faces in each file, by file name, as
+        lists of (left, top, right, bottom), for the 'boxes'
+        detector. Files without boxes have no faces.
+    exit_if_few: bool
+        Whether to exit the program if there are no files or
+        fewer than two faces. Default is True. If False, the
+        faces found are returned however few, e.g. for one
+        shard of a larger set.
+
+    **Returns**
+    records: list
+        A list of FaceRecords, one for each face found
+        in the images of the specified filepath, in the
+        same order as the files
+    """
+    files = glob.glob(os.path.join(imagesfp, "*"))
+    if not files:
+        print("No image files found!")
+        if not exit_if_few:
+            return []
+        raise Exception
+    cache = None
+    if workers > 1:
+        results = _ingest_parallel(files, predictorfp, cache_path, workers, chunksize, keep_pixels, roi, min_face,
+                                   detector, boxes)
+    else:
+        cache = LandmarkCache(cache_path) if cache_path else None
+        results = (ingest_file(file, predictorfp, cache, keep_pixels, roi, min_face, detector,
+                               boxes.get(os.path.basename(file)) if boxes else None) for file in files)
+    records = []
+    faces_per_image = {}
+    for done, (file, found) in enumerate(zip(files, results), 1):
+        faces_per_image[len(found)] = faces_per_image.get(len(found), 0) + 1
+        if progress is not None:
+            progress.update(done, len(files))
+        filename = os.path.basename(file)
+        if not found:
+            print("Dlib was unable to detect a face in '{}'.".format(filename))
+            print("'{}' will not be included in the final average face.".format(filename))
+        if len(found) >= 2:
+            print("Dlib detected two or more faces in '{}'.".format(filename))
+            print("Each face will be averaged separately...")
+        records.extend(found)
+    if cache is not None:
+        cache.close()
+    if progress is not None:
+        progress.counts.update(images=len(files), faces=len(records), faces_per_image=faces_per_image)
+    if not exit_if_few:
+        return records
+    if not records:
+        print("Dlib was unable to detect a face in any of the images!")
+        raise Exception
+    if len(records) == 1:
+        print("Only one face found. At least two are required!")
+        raise Exception
+    return records
+
+
+if __name__ == '__main__':
+    pass
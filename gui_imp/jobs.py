@@ -0,0 +1,398 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# jobs.py
+'''
+This script takes care of running the averager in the
+background for the website, so that a large upload does not
+hold up the request that asked for it. Jobs are handed to a
+bounded pool of worker processes which load the dlib models
+once, when they start, and each job gets an ID that the
+website uses to ask for its status and result.
+While an upload is still arriving, each of its images can be
+handed to the pool on its own with prefetch, so that its faces
+are found and stored in the landmark cache before the job that
+averages them starts. An upload that is never averaged has
+its prefetches dropped with forget_prefetches. While a job
+runs, its progress events (see progress.Progress) are shared
+with the website through a multiprocessing manager. When it
+finishes, its last event is moved out of the manager, and it
+is added to the metrics of the website. Finished jobs are
+forgotten by collect_jobs after a while, like the workspaces
+their results are saved in. A worker that dies, e.g. because it
+ran out of memory, breaks the pool for good, so a broken pool
+is replaced by a new one the next time work is handed to it.
+It contains ten functions:
+    start
+    prefetch
+    forget_prefetches
+    submit_job
+    job_status
+    job_result
+    job_progress
+    collect_jobs
+    run_job
+    run_prefetch
+
+Sources:
+    https://docs.python.org/3/library/concurrent.futures.html
+'''
+import time
+import uuid
+import threading
+from functools import partial
+from multiprocessing import Manager
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from models import warm, PREDICTOR
+from ingest import detect_file
+from landmark_cache import LandmarkCache
+from averager import main
+from progress import Progress
+from metrics import Metrics
+from workspace import content_address
+
+# The worker pool and the progress shared by its jobs, the jobs
+# submitted to it by ID, and the images prefetched for each
+# upload, by workspace
+_pool = {}
+_jobs = {}
+_prefetches = {}
+# When each finished job finished, and its last progress event, by ID
+_finished = {}
+_final = {}
+_lock = threading.Lock()
+
+# Stage timings, memory and counts of every finished job
+metrics = Metrics()
+
+
+def _init_worker(predictorfp):
+    """Loads the models when a worker process starts"""
+    try:
+        warm(predictorfp)
+    except RuntimeError:
+        print("Couldn't load the predictor model, it will be loaded on first use.")
+
+
+def start(workers=2, predictorfp=PREDICTOR):
+    """start creates the worker pool and starts all of its
+    processes straight away, so that the first jobs do not
+    have to wait for workers to start and load the models.
+    Calling it again does nothing, unless the pool was
+    thrown away because it broke.
+
+    **Parameters**
+    workers: int
+        The number of worker processes, i.e. the number
+        of jobs run at the same time. Default is 2.
+    predictorfp: str
+        The filepath name containing the predictor file
+
+    **Returns**
+    None
+    """
+    with _lock:
+        if 'pool' in _pool:
+            return
+        if 'manager' not in _pool:
+            _pool['manager'] = Manager()
+            _pool['progress'] = _pool['manager'].dict()
+        pool = _pool['pool'] = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(predictorfp,))
+        _pool['workers'] = workers
+        _pool['predictorfp'] = predictorfp
+    for _ in range(workers):
+        pool.submit(int)
+
+
+def _submit(function, *args):
+    """Submits a call to the worker pool. A pool broken by a
+    worker that died is thrown away and the call submitted
+    again, once, to a new one."""
+    start()
+    with _lock:
+        pool = _pool['pool']
+    try:
+        return pool.submit(function, *args)
+    except BrokenProcessPool:
+        with _lock:
+            if _pool.get('pool') is pool:
+                del _pool['pool']
+        pool.shutdown(wait=False, cancel_futures=True)
+        start(_pool['workers'], _pool['predictorfp'])
+        with _lock:
+            pool = _pool['pool']
+        return pool.submit(function, *args)
+
+
+def run_job(job_id, image_path, output_path, cache_path, events, detector='hog'):
+    """run_job runs the averager on the images in a
+    filepath. It is what the worker processes run.
+
+    **Parameters**
+    job_id: str
+        The ID of the job
+    image_path: str
+        A string indicating the filepath containing
+        the images to be 'averaged'
+    output_path: str
+        The filepath the averaged image is saved to
+    cache_path: str
+        The filepath of the landmark cache database
+    events: dict
+        The shared dictionary the latest progress event
+        of the job is stored in, under its ID
+    detector: str
+        The face detector, see detect.DETECTORS
+
+    **Returns**
+    output_path: str
+        The filepath of the output image, renamed
+        after its contents, see content_address
+    """
+    progress = Progress(lambda event: events.update({job_id: event}))
+    main(image_path, output_path, clear_inputs=False, cache_path=cache_path, progress=progress,
+         detector=detector)
+    print('Job {} stage timings: {}'.format(job_id, ', '.join(
+        '{} {:.2f}s'.format(stage, seconds) for stage, seconds in progress.timings.items())))
+    return content_address(output_path)
+
+
+def run_prefetch(file, predictorfp, cache_path, detector='hog'):
+    """run_prefetch finds the faces in one uploaded image
+    and stores them in the landmark cache. It is what the
+    worker processes run for prefetch.
+
+    **Parameters**
+    file: str
+        The filepath of the uploaded image
+    predictorfp: str
+        The filepath name containing the predictor file
+    cache_path: str
+        The filepath of the landmark cache database
+    detector: str
+        The face detector, see detect.DETECTORS
+
+    **Returns**
+    count: int
+        The number of faces found in the image
+    """
+    cache = LandmarkCache(cache_path)
+    try:
+        image, faces = detect_file(file, predictorfp, cache, detector=detector)
+        return len(faces)
+    finally:
+        cache.close()
+
+
+def prefetch(group, file, cache_path='landmark_cache.db', detector='hog'):
+    """prefetch queues the faces of one uploaded image to
+    be found, without waiting, so that the work is done
+    while the rest of the upload is still arriving.
+
+    **Parameters**
+    group: str
+        The upload the image belongs to. A job submitted with
+        after=group waits for all of the group's images.
+    file: str
+        The filepath of the uploaded image. Only the path is
+        queued, the worker reads the file itself.
+    cache_path: str
+        The filepath of the landmark cache database
+    detector: str
+        The face detector, see detect.DETECTORS. It must be
+        the one the job is submitted with, for the job to
+        find the faces in the cache. Default is 'hog'.
+
+    **Returns**
+    None
+    """
+    start()
+    future = _submit(run_prefetch, file, _pool['predictorfp'], cache_path, detector)
+    with _lock:
+        _prefetches.setdefault(group, []).append(future)
+
+
+def forget_prefetches(group):
+    """forget_prefetches drops the prefetched images of an
+    upload that will not be averaged, e.g. because its
+    result was cached or its workspace was removed. Those
+    not started yet are cancelled.
+
+    **Parameters**
+    group: str
+        The upload the images belong to
+
+    **Returns**
+    None
+    """
+    with _lock:
+        futures = _prefetches.pop(group, [])
+    for future in futures:
+        future.cancel()
+
+
+def _record(job_id, future):
+    """Adds a finished job to the metrics"""
+    metrics.record('failed' if future.exception() is not None else 'done', job_progress(job_id))
+
+
+def _finish(job_id, future):
+    """Notes when a job finished, for collect_jobs, and
+    moves its last progress event out of the manager"""
+    with _lock:
+        _finished[job_id] = time.time()
+        _final[job_id] = _pool['progress'].get(job_id)
+    _pool['progress'].pop(job_id, None)
+
+
+def _dispatch(job_id, prefetches, image_path, output_path, cache_path, callback, detector):
+    """Submits a job once the images it waits for are prefetched"""
+    wait(prefetches)
+    try:
+        future = _submit(run_job, job_id, image_path, output_path, cache_path, _pool['progress'], detector)
+    except Exception as error:
+        # Run in a thread if there are prefetches, where the error
+        # would be lost and the job left queued for good
+        future = Future()
+        future.set_exception(error)
+    with _lock:
+        _jobs[job_id] = future
+    future.add_done_callback(partial(_record, job_id))
+    future.add_done_callback(partial(_finish, job_id))
+    if callback is not None:
+        future.add_done_callback(lambda f: f.exception() is None and callback(f.result()))
+
+
+def submit_job(image_path, output_path, cache_path='landmark_cache.db', after=None, callback=None,
+               detector='hog'):
+    """submit_job queues the averager to be run on the
+    images in a filepath, and returns without waiting.
+
+    **Parameters**
+    image_path: str
+        A string indicating the filepath containing
+        the images to be 'averaged'
+    output_path: str
+        The filepath the averaged image is saved to
+    cache_path: str
+        The filepath of the landmark cache database
+    after: str
+        The group of prefetched images the job waits for,
+        so that it finds all of their faces in the cache.
+        Default is None, to start the job straight away.
+    callback: function
+        Called with the filepath of the output image, as
+        returned by run_job, when the job has finished
+        without errors. Default is None.
+    detector: str
+        The face detector, see detect.DETECTORS. Default is 'hog'.
+
+    **Returns**
+    job_id: str
+        The ID of the new job
+    """
+    start()
+    job_id = uuid.uuid4().hex
+    with _lock:
+        prefetches = _prefetches.pop(after, [])
+        # The job is queued until its prefetches are done
+        _jobs[job_id] = None
+    if prefetches:
+        threading.Thread(target=_dispatch, daemon=True,
+                         args=(job_id, prefetches, image_path, output_path, cache_path, callback,
+                               detector)).start()
+    else:
+        _dispatch(job_id, prefetches, image_path, output_path, cache_path, callback, detector)
+    return job_id
+
+
+def job_status(job_id):
+    """job_status returns the status of a job.
+
+    **Parameters**
+    job_id: str
+        The ID returned by submit_job
+
+    **Returns**
+    status: str
+        'queued', 'running', 'done' or 'failed', or None
+        if there is no job with this ID, or it has been
+        forgotten by collect_jobs
+    """
+    if job_id not in _jobs:
+        return None
+    future = _jobs[job_id]
+    if future is None:
+        return 'queued'
+    if future.running():
+        return 'running'
+    if not future.done():
+        return 'queued'
+    return 'failed' if future.exception() is not None else 'done'
+
+
+def job_result(job_id):
+    """job_result returns the output of a finished job.
+
+    **Parameters**
+    job_id: str
+        The ID returned by submit_job
+
+    **Returns**
+    output_path: str
+        The filepath of the output image, renamed after its
+        contents, or None if the job failed or has not finished
+    """
+    if job_status(job_id) != 'done':
+        return None
+    return _jobs[job_id].result()
+
+
+def job_progress(job_id):
+    """job_progress returns the latest progress event
+    of a job.
+
+    **Parameters**
+    job_id: str
+        The ID returned by submit_job
+
+    **Returns**
+    event: dict
+        The stage of the job, the images it has done out of
+        the total, the seconds elapsed and the seconds taken
+        by each finished stage (see progress.Progress.event),
+        or None if the job has not started
+    """
+    if 'progress' not in _pool:
+        return None
+    # Read before _final, which is set before the event is
+    # taken out of the manager
+    event = _pool['progress'].get(job_id)
+    return _final.get(job_id, event)
+
+
+def collect_jobs(ttl):
+    """collect_jobs forgets the jobs that finished more
+    than ttl seconds ago, with their results.
+
+    **Parameters**
+    ttl: float
+        The age in seconds after which a finished job
+        is forgotten
+
+    **Returns**
+    removed: int
+        The number of jobs forgotten
+    """
+    cutoff = time.time() - ttl
+    with _lock:
+        expired = [job_id for job_id, finished in _finished.items() if finished < cutoff]
+        for job_id in expired:
+            del _finished[job_id]
+            del _final[job_id]
+            del _jobs[job_id]
+    return len(expired)
+
+
+if __name__ == '__main__':
+    pass
@@ -17,6 +17,8 @@ import cv2
 import dlib
 import glob
 from process_images import face_check
+from models import get_predictor
+from detect import detect_faces
 
 
 def find_landmarks(imagesfp, predictorfp='shape_predictor_68_face_landmarks.dat'):
@@ -45,14 +47,13 @@ def find_landmarks(imagesfp, predictorfp='shape_predictor_68_face_landmarks.dat'
         coordinates of specific facial landmarks for each face in
         each image file in the specified filepath.
     """
-    predictor = dlib.shape_predictor(predictorfp)
-    detector = dlib.get_frontal_face_detector()
+    predictor = get_predictor(predictorfp)
     alllandmarks = []
     for file in glob.glob(os.path.join(imagesfp, "*")):
         image = dlib.load_rgb_image(file)
-        face = detector(image, 1)
+        face = detect_faces(image)
         for k, d in enumerate(face):
-            shape = predictor(image, d)
+            shape = predictor(image, dlib.rectangle(*d))
             landmarks = []
             for point in range(0, shape.num_parts):
                 landmarks.append((int(shape.part(point).x), int(shape.part(point).y)))
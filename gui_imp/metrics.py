@@ -0,0 +1,194 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# metrics.py
+'''
+This script takes care of measuring the averager, so that
+we can see where its time and memory go. summary turns the
+progress of a run (see progress.Progress) into a summary
+that can be saved as JSON, and Metrics gathers the runs of
+the website into histograms in the Prometheus text format.
+It contains two functions and one class:
+    peak_rss
+    summary
+    Metrics
+
+Sources:
+    https://docs.python.org/3/library/resource.html
+    https://prometheus.io/docs/instrumenting/exposition_formats/
+'''
+import sys
+import threading
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Histogram buckets of the metrics recorded for each run
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(6, 14))
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+FACES_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+
+def peak_rss():
+    """peak_rss returns the most memory the process has
+    held in RAM at any one time so far. This is over the
+    whole life of the process, so for a worker process that
+    runs many jobs it is the peak of all of them, not of the
+    job it is running.
+
+    **Parameters**
+    None
+
+    **Returns**
+    rss: int
+        The peak resident set size in bytes, or 0
+        if it cannot be measured on this system
+    """
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def summary(event):
+    """summary turns the final progress event of a run
+    into a summary of each of its stages.
+
+    **Parameters**
+    event: dict
+        The event, see progress.Progress.event
+
+    **Returns**
+    summary: dict
+        The total seconds, the seconds of each stage and the
+        peak resident memory in bytes of the process by the
+        end of each stage, the number of images
+        and faces, and how many images had each number of faces
+    """
+    counts = event.get('counts', {})
+    return {'seconds': event['elapsed'],
+            'stages': {stage: {'seconds': seconds, 'process_peak_rss_bytes': event['memory'].get(stage)}
+                       for stage, seconds in event['timings'].items()},
+            'images': counts.get('images'),
+            'faces': counts.get('faces'),
+            'faces_per_image': {str(faces): images
+                                for faces, images in sorted(counts.get('faces_per_image', {}).items())}}
+
+
+class Metrics(object):
+    """Metrics gathers the runs of the averager into
+    histograms and counters, and writes them in the
+    Prometheus text format for a /metrics endpoint.
+    It is shared by all the threads of the website.
+
+    **Parameters**
+    prefix: str
+        The prefix of every metric name. Default is 'averager'.
+    """
+
+    def __init__(self, prefix='averager'):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._define('runs_total', 'counter', 'Runs of the averager, by status')
+        self._define('stage_seconds', 'histogram', 'Seconds taken by each stage', SECONDS_BUCKETS)
+        # ru_maxrss cannot be reset, so this is the peak of the worker
+        # process over all the jobs it has run, not of one job
+        self._define('worker_peak_rss_bytes', 'histogram',
+                     'Peak resident memory of the worker process over its life so far, '
+                     'at the end of each stage', BYTES_BUCKETS)
+        self._define('run_seconds', 'histogram', 'Seconds taken by each run', SECONDS_BUCKETS)
+        self._define('run_images', 'histogram', 'Images uploaded for each run', COUNT_BUCKETS)
+        self._define('run_faces', 'histogram', 'Faces found for each run', COUNT_BUCKETS)
+        self._define('faces_per_image', 'histogram', 'Faces found in each image', FACES_BUCKETS)
+
+    def _define(self, name, kind, description, buckets=None):
+        self._metrics[name] = {'kind': kind, 'help': description, 'buckets': buckets, 'series': {}}
+
+    def _observe(self, name, value, times=1, **labels):
+        metric = self._metrics[name]
+        key = tuple(sorted(labels.items()))
+        if metric['kind'] == 'counter':
+            metric['series'][key] = metric['series'].get(key, 0) + value
+            return
+        if key not in metric['series']:
+            metric['series'][key] = {'buckets': [0] * len(metric['buckets']), 'sum': 0.0, 'count': 0}
+        series = metric['series'][key]
+        for i, bound in enumerate(metric['buckets']):
+            if value <= bound:
+                series['buckets'][i] += times
+        series['sum'] += value * times
+        series['count'] += times
+
+    def record(self, status, event=None):
+        """record adds a finished run to the metrics.
+
+        **Parameters**
+        status: str
+            How the run ended, e.g. 'done' or 'failed'
+        event: dict
+            The last progress event of the run, see
+            progress.Progress.event. Default is None, if
+            the run failed before reporting anything.
+
+        **Returns**
+        None
+        """
+        with self._lock:
+            self._observe('runs_total', 1, status=status)
+            if event is None:
+                return
+            for stage, seconds in event['timings'].items():
+                self._observe('stage_seconds', seconds, stage=stage)
+            for stage, rss in event['memory'].items():
+                self._observe('worker_peak_rss_bytes', rss, stage=stage)
+            if status != 'done':
+                return
+            counts = event.get('counts', {})
+            self._observe('run_seconds', event['elapsed'])
+            if 'images' in counts:
+                self._observe('run_images', counts['images'])
+                self._observe('run_faces', counts['faces'])
+            for faces, images in counts.get('faces_per_image', {}).items():
+                self._observe('faces_per_image', int(faces), images)
+
+    def render(self):
+        """render writes the metrics in the Prometheus
+        text format.
+
+        **Parameters**
+        None
+
+        **Returns**
+        text: str
+            The metrics, one sample per line
+        """
+        lines = []
+        with self._lock:
+            for name, metric in self._metrics.items():
+                name = '{}_{}'.format(self.prefix, name)
+                lines.append('# HELP {} {}'.format(name, metric['help']))
+                lines.append('# TYPE {} {}'.format(name, metric['kind']))
+                for key, series in sorted(metric['series'].items()):
+                    labels = ['{}="{}"'.format(label, value) for label, value in key]
+                    if metric['kind'] == 'counter':
+                        lines.append('{}{} {}'.format(name, _labels(labels), series))
+                        continue
+                    for bound, count in zip(metric['buckets'], series['buckets']):
+                        le = 'le="{}"'.format(bound)
+                        lines.append('{}_bucket{} {}'.format(name, _labels(labels + [le]), count))
+                    lines.append('{}_bucket{} {}'.format(name, _labels(labels + ['le="+Inf"']), series['count']))
+                    lines.append('{}_sum{} {}'.format(name, _labels(labels), series['sum']))
+                    lines.append('{}_count{} {}'.format(name, _labels(labels), series['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,120 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# models.py
+'''
+This script keeps the models used by the averager in one
+place, so that each model is loaded once per process and then
+shared by every stage of the program. Besides dlib's HOG face
+detector, OpenCV's Haar and LBP cascades can be used to find
+faces; the shape predictor is always dlib's.
+It contains three functions:
+    get_detector
+    get_predictor
+    warm
+
+Sources:
+    http://dlib.net/face_landmark_detection.py.html
+    https://docs.opencv.org/4.x/db/d28/tutorial_cascade_classifier.html
+'''
+import os
+import cv2
+import dlib
+
+PREDICTOR = 'shape_predictor_68_face_landmarks.dat'
+
+# The cascade files of the OpenCV detectors. Each is looked for as
+# given, then in OpenCV's own data directories. The LBP cascade is
+# not shipped with the opencv-python wheels, so it may have to be
+# downloaded from OpenCV's repository and its path set here. The
+# cascades need OpenCV 4: OpenCV 5 has no cv2.CascadeClassifier
+# and ships no cascade files.
+CASCADES = {'haar': 'haarcascade_frontalface_default.xml',
+            'lbp': 'lbpcascade_frontalface_improved.xml'}
+
+# Models loaded so far in this process
+_detectors = {}
+_predictors = {}
+
+
+def get_detector(name='hog'):
+    """get_detector returns a face detector,
+    creating it on first use.
+
+    **Parameters**
+    name: str
+        'hog' for dlib's frontal face detector, or 'haar' or
+        'lbp' for one of OpenCV's cascades, see CASCADES.
+        Default is 'hog'.
+
+    **Returns**
+    detector: dlib.fhog_object_detector or cv2.CascadeClassifier
+        The face detector
+    """
+    if name not in _detectors:
+        if name == 'hog':
+            _detectors[name] = dlib.get_frontal_face_detector()
+        elif name in CASCADES:
+            _detectors[name] = _load_cascade(CASCADES[name])
+        else:
+            raise ValueError("Unknown face detector '{}'".format(name))
+    return _detectors[name]
+
+
+def _load_cascade(filename):
+    """Loads an OpenCV cascade, looking for the file as
+    given and then in OpenCV's data directories"""
+    if not hasattr(cv2, 'CascadeClassifier'):
+        raise RuntimeError("OpenCV {} has no cascade classifier. The '{}' cascade needs OpenCV 4, e.g. "
+                           "pip3 install 'opencv-python<5'".format(cv2.__version__, filename))
+    folder = getattr(getattr(cv2, 'data', None), 'haarcascades', '')
+    for path in (filename, os.path.join(folder, filename),
+                 os.path.join(os.path.dirname(os.path.normpath(folder)), 'lbpcascades', filename)):
+        if os.path.isfile(path):
+            cascade = cv2.CascadeClassifier(path)
+            if not cascade.empty():
+                return cascade
+    raise RuntimeError("Couldn't load the cascade '{}'".format(filename))
+
+
+def get_predictor(predictorfp=PREDICTOR):
+    """get_predictor returns the shape predictor
+    stored in a given file, loading it on first use.
+
+    **Parameters**
+    predictorfp: str
+        The filepath name containing the predictor file. Default is
+        'shape_predictor_68_face_landmarks.dat'.
+
+    **Returns**
+    predictor: dlib.shape_predictor
+        The loaded shape predictor
+    """
+    if predictorfp not in _predictors:
+        _predictors[predictorfp] = dlib.shape_predictor(predictorfp)
+    return _predictors[predictorfp]
+
+
+def warm(predictorfp=PREDICTOR, detector='hog'):
+    """warm loads the detector and predictor ahead of
+    time. Calling it before worker processes are forked
+    lets them share the loaded models copy-on-write
+    instead of each loading their own.
+
+    **Parameters**
+    predictorfp: str
+        The filepath name containing the predictor file. Default is
+        'shape_predictor_68_face_landmarks.dat'.
+    detector: str
+        The face detector to load, see get_detector, or 'boxes'
+        if faces are supplied rather than detected. Default is 'hog'.
+
+    **Returns**
+    None
+    """
+    if detector != 'boxes':
+        get_detector(detector)
+    get_predictor(predictorfp)
+
+
+if __name__ == '__main__':
+    pass
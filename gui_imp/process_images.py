@@ -20,6 +20,7 @@ import numpy as np
 import dlib
 import sys
 from PIL import Image
+from ingest import ingest_file
 
 
 def process_images(imagesfp):
@@ -56,49 +57,47 @@ def process_images(imagesfp):
     return images
 
 
-def face_check(imagesfp):
+def face_check(imagesfp, predictorfp='shape_predictor_68_face_landmarks.dat'):
     """face_check is used to perform
     a preliminary check on the images in the filepath
     to make sure that there won't be any problems down the line
     in the program. For example, if dlib is unable to detect a
-    face in one of the images, it will remove it from the
-    filepath so that it is not included in the face average.
-    If dlib detects more than one face in an image, it will
-    create new images corresponding to each face in the original image
-    and then remove the original image, so that an accurate average
-    can be found. If no faces are found in any of the images, it will
-    exit the program.
+    face in one of the images, it is left out of the samples
+    so that it is not included in the face average.
+    If dlib detects more than one face in an image, the image
+    is expanded in memory into one sample for each face, so that
+    an accurate average can be found. Nothing in the filepath
+    is written or removed, so it may be read-only. If no faces
+    are found in any of the images, it will exit the program.
 
     **Parameters**
     imagesfp: str
         The name of the folder containing the images
         to be averaged
+    predictorfp: str
+        The filepath name containing the predictor file. Default is
+        'shape_predictor_68_face_landmarks.dat'.
 
     **Returns**
-    None
+    samples: list
+        A list of FaceRecords, one for each face found,
+        each carrying the landmarks of its face
     """
-    detector = dlib.get_frontal_face_detector()
-    detections = []
+    samples = []
     for file in glob.glob(os.path.join(imagesfp, "*")):
-        filename = file.split('/')[-1]
-        image = dlib.load_rgb_image(file)
-        imheight, imwidth, channels = image.shape
-        faces = detector(image, 1)
+        filename = os.path.basename(file)
+        faces = ingest_file(file, predictorfp)
         if not faces:
             print("Dlib was unable to detect a face in '{}'.".format(filename))
             print("'{}' will not be included in the final average face.".format(filename))
-            os.remove(file)
         if len(faces) >= 2:
             print("Dlib detected two or more faces in '{}'.".format(filename))
-            print("Copying image around each cropped face...")
-            for k, d in enumerate(faces):
-                img_new = image[max(0, d.top()):min(d.bottom(), imheight), max(0, d.left()):min(d.right(), imwidth)]
-                dlib.save_image(img_new, os.path.join(imagesfp, 'newerface_{}.png'.format(k)))
-            os.remove(file)
-        detections.append(len(faces))
-    if all(d == 0 for d in detections):
+            print("Keeping a separate sample for each face...")
+        samples.extend(faces)
+    if not samples:
         print("Dlib was unable to detect a face in any of the images!")
         raise Exception
+    return samples
 
 if __name__ == '__main__':
     pass
@@ -0,0 +1,118 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# result_cache.py
+'''
+This script takes care of caching the averaged images made
+by the website, so that averaging the same set of photos
+again, e.g. after a refresh, returns the earlier result
+straight away instead of running the averager again.
+Results are keyed by the content hashes of the input images,
+sorted so that neither their names nor their order matter,
+together with the output parameters. The least recently used
+results are evicted once the cache holds more than a set
+number of bytes.
+It contains one function and one class:
+    result_key
+    ResultCache
+
+Sources:
+    https://docs.python.org/3/library/collections.html#collections.OrderedDict
+    https://docs.python.org/3/library/hashlib.html
+'''
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def result_key(image_path, **params):
+    """result_key finds the key under which the averaged
+    image of the images in a filepath is stored.
+
+    **Parameters**
+    image_path: str
+        A string indicating the filepath containing
+        the images to be 'averaged'
+    params: keyword arguments
+        The output parameters used, e.g. width=600
+
+    **Returns**
+    key: str
+        A hex digest identifying the images and parameters
+    """
+    hashes = []
+    for file in os.listdir(image_path):
+        digest = hashlib.sha256()
+        with open(os.path.join(image_path, file), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        hashes.append(digest.hexdigest())
+    key = hashlib.sha256()
+    for digest in sorted(hashes):
+        key.update(digest.encode())
+    key.update(json.dumps(params, sort_keys=True).encode())
+    return key.hexdigest()
+
+
+class ResultCache(object):
+    """ResultCache stores encoded averaged images in memory.
+    It is shared by all the threads of the website.
+
+    **Parameters**
+    max_bytes: int
+        The total size of the images kept before the least
+        recently used ones are evicted. Default is 64 MB.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """get returns the image stored under a key.
+
+        **Parameters**
+        key: str
+            The key, see result_key
+
+        **Returns**
+        data: bytes
+            The encoded image, or None if it is not cached
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        """put stores an image under a key, evicting the least
+        recently used images if the cache grows too large. An
+        image larger than the whole cache is not stored.
+
+        **Parameters**
+        key: str
+            The key, see result_key
+        data: bytes
+            The encoded image
+
+        **Returns**
+        None
+        """
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+if __name__ == '__main__':
+    pass
@@ -4,20 +4,72 @@
 '''
 This script takes care of scaling images and landmarks
 to a common space to allow for averaging and proper
-transformations.
+transformations. The transform of each image is found once,
+by eye_transforms, and shared by scale_images and scale_landmarks.
 
 Source:
     https://github.com/spmallick/learnopencv/tree/master/FaceAverage
 '''
 import numpy as np
 import cv2
-from transform import similarity_transform
+from transform import similarity_transforms
 
 width = 600
 height = 600
+# Where the outer corners of the eyes (landmarks 36 and 45) are placed
+eyecornerDst = [(int(0.3 * width), int(height / 3)), (int(0.7 * width), int(height / 3))]
+# Boundary points added for delaunay triangulation
+boundaryPts = np.float32([(0, 0), (width/2, 0), (width-1, 0), (width-1, height/2), (width-1, height-1), (width/2, height-1), (0, height-1), (0, height/2)])
 
 
-def scale_images(images, alllandmarks):
+def eye_transforms(alllandmarks):
+    """eye_transforms finds, for every image, the
+    similarity transform taking the outer corners of the
+    eyes to their place in the common space. All the
+    transforms are found in one vectorized pass.
+
+    **Parameters**
+    alllandmarks: list
+        A list of lists of tuples correpsonding
+        to facial landmarks for each of the images
+
+    **Returns**
+    tforms: numpy array
+        An (N, 2, 3) array of the N transforms
+    """
+    landmarks = np.asarray(alllandmarks, np.float64)
+    return similarity_transforms(landmarks[:, [36, 45]], eyecornerDst)
+
+
+def face_region(landmarks, margin=2):
+    """face_region finds the region of an image that
+    ends up in the common space once the image is scaled,
+    i.e. the output frame mapped back onto the image. Only
+    this part of an image is needed to average its face.
+
+    **Parameters**
+    landmarks: list
+        A list of tuples corresponding to the facial
+        landmarks of one face
+    margin: int
+        Extra pixels kept around the region for
+        interpolation. Default is 2.
+
+    **Returns**
+    region: tuple
+        (left, top, right, bottom) of the region. left and
+        top are clipped to the image, right and bottom are
+        not, as slicing clips them anyway.
+    """
+    inverse = cv2.invertAffineTransform(eye_transforms([landmarks])[0])
+    corners = np.float64([(0, 0), (width, 0), (0, height), (width, height)])
+    corners = np.matmul(corners, inverse[:, :2].T) + inverse[:, 2]
+    left, top = np.maximum(np.floor(corners.min(axis=0)) - margin, 0)
+    right, bottom = np.ceil(corners.max(axis=0)) + margin
+    return int(left), int(top), int(max(right, left + 1)), int(max(bottom, top + 1))
+
+
+def scale_images(images, alllandmarks, tforms=None):
     """scale_images takes in images and then
     transforms all the images to a common space.
 
@@ -32,6 +84,9 @@ def scale_images(images, alllandmarks):
         A list of lists of tuples correpsonding
         to facial landmarks for each of the images
         in the images list
+    tforms: numpy array
+        The transforms found by eye_transforms. They are
+        found here if not given.
 
     **Returns**
     scaled_images: list
@@ -39,20 +94,55 @@ def scale_images(images, alllandmarks):
         coordinates from individual images scaled
         to a common space
     """
-    eyecornerDst = [(np.int(0.3 * width), np.int(height / 3)), (np.int(0.7 * width), np.int(height / 3))]
-    numImages = len(images)
-    # Warp images and trasnform landmarks to output coordinate system,
+    if tforms is None:
+        tforms = eye_transforms(alllandmarks)
+    # Warp images to output coordinate system
     scaled_images = []
-    for i in range(0, numImages):
-        # Corners of the eye in input image
-        eyecornerSrc = [alllandmarks[i][36], alllandmarks[i][45]]
-        # Compute similarity transform
-        tform = similarity_transform(eyecornerSrc, eyecornerDst)
-        scaled_images.append(cv2.warpAffine(images[i], tform, (width, height)))
+    for i in range(0, len(images)):
+        scaled_images.append(cv2.warpAffine(images[i], tforms[i], (width, height)))
     return scaled_images
 
 
-def scale_landmarks(images, alllandmarks):
+def scale_image(image, tform):
+    """scale_image scales one image to the common space.
+
+    **Parameters**
+    image: numpy array
+        The image
+    tform: numpy array
+        Its transform, as found by eye_transforms
+
+    **Returns**
+    scaled_image: numpy array
+        The image scaled to the common space, or None
+        if the image is None
+    """
+    if image is None:
+        return None
+    return cv2.warpAffine(image, tform, (width, height))
+
+
+def iter_scaled_images(images, tforms):
+    """iter_scaled_images is the generator version of
+    scale_images. Images are taken from any iterable and
+    scaled one at a time, so that a whole set of images
+    never has to be held in memory.
+
+    **Parameters**
+    images: iterable
+        An iterable of numpy arrays, e.g. ingest.iter_images
+    tforms: numpy array
+        The transforms found by eye_transforms
+
+    **Returns**
+    scaled_image: numpy array
+        Each image scaled to the common space
+    """
+    for image, tform in zip(images, tforms):
+        yield scale_image(image, tform)
+
+
+def scale_landmarks(images, alllandmarks, tforms=None):
     """scale_images takes in images and then
     transforms all the images to a common space.
 
@@ -67,39 +157,30 @@ def scale_landmarks(images, alllandmarks):
         A list of lists of tuples correpsonding
         to facial landmarks for each of the images
         in the images list
+    tforms: numpy array
+        The transforms found by eye_transforms. They are
+        found here if not given.
 
     **Returns**
-    pointsNorm: list
-        A list of tuples corresponding to the
+    pointsNorm: numpy array
+        An (N, 76, 2) array corresponding to the
         norm of all the coordinates of facial landmarks
         from all the images in the original filepath
-    pointsAvg: list
+    pointsAvg: numpy array
         A list of tuples corresponding to the
         average of all the coordinates of facial landmarks
         from all the images in the original filepath
     """
-    pointsNorm = []
-    # Add boundary points for delaunay triangulation
-    boundaryPts = np.array([(0, 0), (width/2, 0), (width-1, 0), (width-1, height/2), (width-1, height-1), (width/2, height-1), (0, height-1), (0, height/2)])
-    # Initialize location of average points to 0s
-    pointsAvg = np.array([(0, 0)] * (len(alllandmarks[0]) + len(boundaryPts)), np.float32())
-    eyecornerDst = [(np.int(0.3 * width), np.int(height / 3)), (np.int(0.7 * width), np.int(height / 3))]
-
-    n = len(alllandmarks[0])
-    numImages = len(images)
-    for i in range(0, numImages):
-        eyecornerSrc = [alllandmarks[i][36], alllandmarks[i][45]]
-        # Compute similarity transform
-        tform = similarity_transform(eyecornerSrc, eyecornerDst)
-        points1 = alllandmarks[i]
-        points2 = np.reshape(np.array(points1), (68, 1, 2))
-        points = cv2.transform(points2, tform)
-        points = np.float32(np.reshape(points, (68, 2)))
-        # Append boundary points. Will be used in Delaunay Triangulation
-        points = np.append(points, boundaryPts, axis=0)
-        # Calculate location of average landmark points.
-        pointsAvg = pointsAvg + points / numImages
-        pointsNorm.append(points)
+    if tforms is None:
+        tforms = eye_transforms(alllandmarks)
+    landmarks = np.asarray(alllandmarks, np.float64)
+    # Transform the landmarks of all images with one batched product
+    points = np.matmul(landmarks, tforms[:, :, :2].transpose(0, 2, 1)) + tforms[:, np.newaxis, :, 2]
+    # Append boundary points. Will be used in Delaunay Triangulation
+    boundary = np.broadcast_to(boundaryPts, (len(points),) + boundaryPts.shape)
+    pointsNorm = np.concatenate([np.float32(points), boundary], axis=1)
+    # Calculate location of average landmark points.
+    pointsAvg = pointsNorm.mean(axis=0)
     return pointsAvg, pointsNorm
 
 if __name__ == '__main__':
@@ -13,12 +13,52 @@ from flask import Flask
 from flask import render_template
 from flask import request
 from flask import send_from_directory
-from averager import main
+from flask import jsonify
+from flask import abort
+from flask import Response
+from werkzeug.utils import secure_filename
+from models import warm
+from uploads import iter_uploads
+from result_cache import result_key, ResultCache
+from workspace import create_workspace, workspace_path, unique_path, content_address, collect_garbage
+import jobs
+import scale
 import os
+import json
+import time
+import shutil
 
 app = Flask(__name__)
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+# Static files and uploaded images are revalidated with
+# ETag/Last-Modified after an hour.
+# Output images are named after their contents, so they never change
+# and are cached for OUTPUT_MAX_AGE seconds.
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 3600
+app.config['OUTPUT_MAX_AGE'] = 365 * 24 * 3600
+# Number of averaging jobs run at the same time
+app.config['AVERAGER_WORKERS'] = 2
+# Every upload gets its own workspace here, removed after WORKSPACE_TTL seconds
+app.config['WORKSPACE_ROOT'] = os.path.join(APP_ROOT, 'workspaces')
+app.config['WORKSPACE_TTL'] = 3600
+app.config['LANDMARK_CACHE'] = os.path.join(APP_ROOT, 'landmark_cache.db')
+# Face detector: 'hog' (dlib) finds the most faces, 'haar' and 'lbp'
+# (OpenCV cascades) are faster on frontal, well lit photos
+app.config['FACE_DETECTOR'] = 'hog'
+# Largest upload request, and largest single image in it, in bytes
+app.config['MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024
+app.config['MAX_FILE_SIZE'] = 20 * 1024 * 1024
+# Averaged images kept in memory for repeated uploads, in bytes
+app.config['RESULT_CACHE_SIZE'] = 64 * 1024 * 1024
+results = ResultCache(app.config['RESULT_CACHE_SIZE'])
+
+# Load the dlib models once, when the site starts, rather than on
+# every request. Under a pre-forking server (e.g. gunicorn --preload)
+# this runs before the workers are forked, so they share the models.
+try:
+    warm(detector=app.config['FACE_DETECTOR'])
+except RuntimeError:
+    print("Couldn't load the predictor model, it will be loaded on first use.")
 
 
 @app.route('/')
@@ -38,14 +78,18 @@ def averager():
 @app.route('/upload', methods=["POST"])
 def upload():
     """ upload takes care of the image
-    uploading process. It will create a
-    directory to place the images uploaded if one
-    does not already exist. Then it will
+    uploading process. It will create a new
+    workspace for the images uploaded. Then it will
     interact with upload.html found in ./templates
     to allow the user to upload images and save
-    them to the directory. If no images are
+    them to the workspace. The request body is read
+    as it arrives, and each image is saved and queued
+    for face detection as soon as it is in, rather
+    than after the whole upload. Images larger than
+    MAX_FILE_SIZE are skipped. If no images are
     uploaded it will reload the upload page
-    with an error message.
+    with an error message. Stale workspaces and
+    jobs of earlier uploads are removed along the way.
 
     **Parameters**
     None
@@ -53,53 +97,173 @@ def upload():
     **Returns**
     execute.html: html template page
     images: list
-        list of images names in 'static/faces/'
+        list of image paths in the workspace
+    workspace: str
+        the ID of the workspace
     """
-    target = os.path.join(APP_ROOT, 'static/faces/')
-    if not os.path.isdir(target):
-            os.mkdir(target)
-    else:
-        print("Couldn't create upload directory: {}".format(target))
-    for upload in request.files.getlist("file"):
-        print("{} is the file name".format(upload.filename))
-        filename = upload.filename
-        destination = "/".join([target, filename])
-        try:
-            upload.save(destination)
-        except IsADirectoryError:
-            return render_template("noimages.html")
-    images = os.listdir(os.path.join(APP_ROOT, 'static/faces/'))
-    images = ['faces/' + file for file in images]
-    return render_template("execute.html", images=images)
-
-
-@app.route('/upload/<filename>')
-def send_image(images):
-    """ send_images sends the filename of the
-    image files uploaded to be used in the
-    execute.html page where the uploaded images
-    are displayed.
+    root = app.config['WORKSPACE_ROOT']
+    for removed in collect_garbage(root, app.config['WORKSPACE_TTL']):
+        jobs.forget_prefetches(removed)
+    # The results of jobs are in their workspaces, so are kept as long
+    jobs.collect_jobs(app.config['WORKSPACE_TTL'])
+    workspace = create_workspace(root)
+    target = workspace_path(root, workspace, 'faces')
+    for filename, data in iter_uploads(request.stream, request.headers.get('Content-Type', ''),
+                                       app.config['MAX_FILE_SIZE']):
+        if not secure_filename(filename):
+            continue
+        if data is None:
+            print("{} is too large, skipping it".format(filename))
+            continue
+        print("{} is the file name".format(filename))
+        path = unique_path(target, secure_filename(filename))
+        with open(path, 'wb') as f:
+            f.write(data)
+        jobs.prefetch(workspace, path, app.config['LANDMARK_CACHE'], app.config['FACE_DETECTOR'])
+    if not os.listdir(target):
+        shutil.rmtree(workspace_path(root, workspace), ignore_errors=True)
+        return render_template("noimages.html")
+    images = ['/'.join([workspace, 'faces', file]) for file in os.listdir(target)]
+    return render_template("execute.html", images=images, workspace=workspace)
+
+
+@app.route('/workspaces/<path:filename>')
+def workspace_file(filename):
+    """ workspace_file sends a file from a workspace,
+    either an uploaded image displayed on execute.html
+    or an output image displayed on success.html.
+    Output images are named after their contents, so
+    they are sent with a long lived, immutable
+    Cache-Control header. Uploaded images are the user's
+    own photos, so they are private: only the user's
+    browser may keep them, not shared proxies. Either
+    way the browser can revalidate with ETag and
+    Last-Modified.
 
     **Parameters**
-    images: list
-        the images list created and returned
-        by upload()
+    filename: str
+        the path of the file inside the workspaces directory
 
     **Returns**
-    The filename of the images requested by
-    execute.html for display.
+    The file requested for display.
     """
-    return send_from_directory("static/faces", images)
+    if filename.split('/')[1:2] == ['output']:
+        response = send_from_directory(app.config['WORKSPACE_ROOT'], filename,
+                                       max_age=app.config['OUTPUT_MAX_AGE'])
+        response.cache_control.immutable = True
+        return response
+    response = send_from_directory(app.config['WORKSPACE_ROOT'], filename)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 
 
 @app.route('/execute', methods=["POST", "GET"])
 def execute():
-    """ execute() calls the averager script main()
-    to be executed on the images found in the filepath
+    """ execute() queues the averager script main()
+    to be executed on the images in a workspace
+    and returns straight away, with a page that waits
+    for the job to finish. If the same images have
+    been averaged before, the cached result is
+    shown instead.
 
     **Parameters**
     None
 
+    **Returns**
+    success.html if the result was cached,
+    pending.html with the ID of the queued job, or
+    noimages.html if the workspace does not exist
+    """
+    root = app.config['WORKSPACE_ROOT']
+    workspace = request.values.get('workspace')
+    file_path = workspace_path(root, workspace, 'faces')
+    if file_path is None:
+        return render_template("noimages.html")
+    output_path = workspace_path(root, workspace, 'output', 'average_face.png')
+    key = result_key(file_path, width=scale.width, height=scale.height, detector=app.config['FACE_DETECTOR'])
+    data = results.get(key)
+    if data is not None:
+        print('Found the averaged image in the result cache.')
+        jobs.forget_prefetches(workspace)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        output_path = content_address(output_path)
+        return render_template("success.html", output_image=os.path.relpath(output_path, root))
+
+    def store(path):
+        with open(path, 'rb') as f:
+            results.put(key, f.read())
+
+    # Wait for the faces of the upload to be found first
+    job_id = jobs.submit_job(file_path, output_path, app.config['LANDMARK_CACHE'],
+                             after=workspace, callback=store, detector=app.config['FACE_DETECTOR'])
+    return render_template("pending.html", job_id=job_id)
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """ job_status returns the status of a job as
+    JSON, for pending.html to poll.
+
+    **Parameters**
+    job_id: str
+        the ID of the job
+
+    **Returns**
+    {"status": ..., "progress": ...} where the status
+    is one of 'queued', 'running', 'done' or 'failed',
+    and the progress is the latest event of the job
+    (see progress.Progress.event) or null
+    """
+    status = jobs.job_status(job_id)
+    if status is None:
+        abort(404)
+    return jsonify(status=status, progress=jobs.job_progress(job_id))
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """ job_events streams the status and progress
+    of a job to pending.html as Server-Sent Events,
+    until the job is done or has failed.
+
+    **Parameters**
+    job_id: str
+        the ID of the job
+
+    **Returns**
+    A text/event-stream response, each event holding
+    the same JSON as job_status
+    """
+    if jobs.job_status(job_id) is None:
+        abort(404)
+
+    def events():
+        last = None
+        while True:
+            status = jobs.job_status(job_id)
+            progress = jobs.job_progress(job_id)
+            # The elapsed time always changes, so compare without it
+            state = (status, progress and (progress['stage'], progress['done']))
+            if state != last:
+                last = state
+                yield 'data: {}\n\n'.format(json.dumps({'status': status, 'progress': progress}))
+            if status in ('done', 'failed'):
+                return
+            time.sleep(0.5)
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-store'})
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """ job_result shows the result of a job.
+
+    **Parameters**
+    job_id: str
+        the ID of the job
+
     **Returns**
     success.html and output image path if no
     errors were encountered in executing the averager
@@ -107,32 +271,27 @@ def execute():
 
     failure.html if errors were encountered in executing
     the averager script.
+
+    pending.html if the job has not finished yet.
     """
-    file_path = 'static/faces/'
-    output_impath = 'average_face.png'
-    try:
-        average_face = main(file_path)
-        return render_template("success.html", output_image=output_impath)
-    except Exception:
+    status = jobs.job_status(job_id)
+    if status is None:
+        abort(404)
+    if status == 'done':
+        output_image = os.path.relpath(jobs.job_result(job_id), app.config['WORKSPACE_ROOT'])
+        return render_template("success.html", output_image=output_image)
+    if status == 'failed':
         return render_template("failure.html")
+    return render_template("pending.html", job_id=job_id)
 
 
-@app.route('/execute/<output_impath>')
-def output_image(output_impath):
-    """ output_image sends the filename of the
-    output image to be used in the
-    success.html page where the output image
-    is displayed.
-
-    **Parameters**
-    images: str
-        the filepath of the output image
-
-    **Returns**
-    The filename of the output image
-    requested by success.html for display.
+@app.route('/metrics')
+def metrics():
+    """ metrics returns the stage timings, peak memory
+    and image and face counts of the jobs run so far,
+    as histograms in the Prometheus text format.
     """
-    return send_from_directory("static/outputimage", output_impath)
+    return Response(jobs.metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/about')
@@ -150,18 +309,23 @@ def acknowledgements():
 
 @app.after_request
 def add_header(response):
-    """add_header() takes care of clearing the cache.
-    This is important because after the averager
-    script saves the output image, it is displayed by
-    success.html which is then cached by the browser.
-
-    If the browser cache is not cleared, then
-    the new output image will not be displayed on the
-    success.html page.
+    """add_header() stops the browser from caching
+    pages and job statuses. These depend on the
+    upload and the state of its job, so a cached
+    copy would show a stale result.
+
+    Files, i.e. static files and images in the
+    workspaces, are left to the Cache-Control
+    header set when they are sent.
     """
-    if 'Cache-Control' not in response.headers:
+    if response.mimetype in ('text/html', 'application/json') and 'Cache-Control' not in response.headers:
         response.headers['Cache-Control'] = 'no-store'
     return response
 
 if __name__ == '__main__':
-    app.run(debug=False)
+    # Start the worker pool before serving, so that it is warm
+    # by the first request. Otherwise it starts on the first job.
+    jobs.start(app.config['AVERAGER_WORKERS'])
+    # Each request works in its own workspace, so they can be
+    # served from several threads at once
+    app.run(debug=False, threaded=True)
@@ -0,0 +1,26 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# conftest.py
+'''
+This script sets up the tests of gui_imp. The scripts of
+gui_imp import each other by name, so the directory is put
+on the path for the tests to import them the same way.
+local_imp and gui_imp have scripts of the same names, so
+when the tests of both are run together, those imported for
+the other's tests are dropped first, for these tests to
+import their own.
+'''
+import os
+import sys
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT = os.path.dirname(HERE)
+
+for name, module in list(sys.modules.items()):
+    file = getattr(module, '__file__', None)
+    if not file or not os.path.exists(os.path.join(HERE, name + '.py')):
+        continue
+    directory = os.path.dirname(os.path.abspath(file))
+    if directory != HERE and os.path.dirname(directory) == ROOT:
+        del sys.modules[name]
+sys.path.insert(0, HERE)
@@ -0,0 +1,68 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_jobs.py
+'''
+This script tests that the worker pool of the website keeps
+running jobs after one of its workers dies. The jobs do not
+average anything, so the dlib model is not needed, but jobs
+imports dlib.
+'''
+import os
+import time
+import pytest
+pytest.importorskip('dlib')
+import jobs
+
+
+def die(job_id, image_path, output_path, cache_path, events, detector='hog'):
+    """A job whose worker dies, as if it ran out of memory"""
+    os._exit(1)
+
+
+def finish(job_id, image_path, output_path, cache_path, events, detector='hog'):
+    """A job that finishes straight away"""
+    return output_path
+
+
+def found(file, predictorfp, cache_path, detector='hog'):
+    """A prefetch that finds no faces"""
+    return 0
+
+
+@pytest.fixture(autouse=True)
+def pool():
+    jobs.start(1)
+    yield
+    jobs._pool['pool'].shutdown(cancel_futures=True)
+    jobs._pool['manager'].shutdown()
+    jobs._pool.clear()
+    jobs._jobs.clear()
+    jobs._prefetches.clear()
+
+
+def finished(job_id, timeout=30):
+    """Waits for a job to finish, and returns its status"""
+    deadline = time.time() + timeout
+    while jobs.job_status(job_id) in ('queued', 'running'):
+        assert time.time() < deadline, 'the job never finished'
+        time.sleep(0.05)
+    return jobs.job_status(job_id)
+
+
+def test_job_runs_after_a_worker_dies(monkeypatch):
+    monkeypatch.setattr(jobs, 'run_job', die)
+    assert finished(jobs.submit_job('faces', 'output.png')) == 'failed'
+    monkeypatch.setattr(jobs, 'run_job', finish)
+    job_id = jobs.submit_job('faces', 'output.png')
+    assert finished(job_id) == 'done'
+    assert jobs.job_result(job_id) == 'output.png'
+
+
+def test_job_waiting_on_prefetches_runs_after_a_worker_dies(monkeypatch):
+    monkeypatch.setattr(jobs, 'run_job', die)
+    monkeypatch.setattr(jobs, 'run_prefetch', found)
+    assert finished(jobs.submit_job('faces', 'output.png')) == 'failed'
+    monkeypatch.setattr(jobs, 'run_job', finish)
+    jobs.prefetch('upload', 'face.jpg')
+    job_id = jobs.submit_job('faces', 'output.png', after='upload')
+    assert finished(job_id) == 'done'
@@ -0,0 +1,72 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_result_cache.py
+'''
+This script tests the result cache of the website: that the
+key of a set of images depends only on their contents and
+the parameters, and that the least recently used results
+are evicted once the cache holds too many bytes.
+'''
+from result_cache import ResultCache, result_key
+
+
+def folder(path, files):
+    path.mkdir()
+    for name, data in files.items():
+        (path / name).write_bytes(data)
+    return str(path)
+
+
+def test_key_ignores_names_and_order(tmp_path):
+    first = folder(tmp_path / 'first', {'a.jpg': b'one', 'b.jpg': b'two'})
+    second = folder(tmp_path / 'second', {'z.jpg': b'two', 'y.jpg': b'one'})
+    assert result_key(first, width=600) == result_key(second, width=600)
+
+
+def test_key_changes_with_contents_and_parameters(tmp_path):
+    first = folder(tmp_path / 'first', {'a.jpg': b'one', 'b.jpg': b'two'})
+    second = folder(tmp_path / 'second', {'a.jpg': b'one', 'b.jpg': b'three'})
+    third = folder(tmp_path / 'third', {'a.jpg': b'one'})
+    keys = {result_key(first, width=600), result_key(second, width=600), result_key(third, width=600),
+            result_key(first, width=300), result_key(first, width=600, detector='haar')}
+    assert len(keys) == 5
+
+
+def test_get_and_put():
+    cache = ResultCache(100)
+    assert cache.get('a') is None
+    cache.put('a', b'x' * 10)
+    assert cache.get('a') == b'x' * 10
+    cache.put('a', b'y' * 20)
+    assert cache.get('a') == b'y' * 20
+    assert cache.size == 20
+
+
+def test_least_recently_used_are_evicted():
+    cache = ResultCache(100)
+    cache.put('a', b'a' * 40)
+    cache.put('b', b'b' * 40)
+    assert cache.get('a') is not None
+    cache.put('c', b'c' * 40)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.size == 80
+
+
+def test_evicts_as_many_as_needed():
+    cache = ResultCache(100)
+    for key in 'abcd':
+        cache.put(key, key.encode() * 25)
+    cache.put('e', b'e' * 90)
+    assert [cache.get(key) is not None for key in 'abcde'] == [False, False, False, False, True]
+    assert cache.size == 90
+
+
+def test_too_large_is_not_stored():
+    cache = ResultCache(100)
+    cache.put('a', b'a' * 50)
+    cache.put('b', b'b' * 101)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.size == 50
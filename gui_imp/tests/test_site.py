@@ -0,0 +1,44 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_site.py
+'''
+This script tests the Cache-Control headers the website sends
+the images of a workspace with. site.py is loaded under another
+name, since Python has a site module of its own, and it imports
+dlib.
+'''
+import os
+import importlib.util
+import pytest
+pytest.importorskip('dlib')
+from workspace import create_workspace
+
+spec = importlib.util.spec_from_file_location(
+    'website', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'site.py'))
+website = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(website)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setitem(website.app.config, 'WORKSPACE_ROOT', str(tmp_path))
+    return website.app.test_client()
+
+
+def test_uploaded_images_are_private(client, tmp_path):
+    workspace = create_workspace(str(tmp_path))
+    (tmp_path / workspace / 'faces' / 'face.jpg').write_bytes(b'photo')
+    response = client.get('/workspaces/{}/faces/face.jpg'.format(workspace))
+    assert response.data == b'photo'
+    assert response.cache_control.private
+    assert not response.cache_control.public
+    assert not response.cache_control.immutable
+
+
+def test_outputs_are_cached_for_good(client, tmp_path):
+    workspace = create_workspace(str(tmp_path))
+    (tmp_path / workspace / 'output' / 'average.png').write_bytes(b'average')
+    response = client.get('/workspaces/{}/output/average.png'.format(workspace))
+    assert response.cache_control.public
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == website.app.config['OUTPUT_MAX_AGE']
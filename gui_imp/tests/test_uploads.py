@@ -0,0 +1,62 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_uploads.py
+'''
+This script tests reading uploaded files straight from a
+multipart request body: the limit on the size of each file,
+fields that are not files, and bodies that end too soon.
+'''
+import io
+import pytest
+from uploads import iter_uploads
+
+BOUNDARY = 'boundary42'
+CONTENT_TYPE = 'multipart/form-data; boundary=' + BOUNDARY
+
+
+def body(*parts):
+    """Encodes (name, filename, data) parts as a multipart
+    body. A filename of None makes a field, not a file."""
+    encoded = b''
+    for name, filename, data in parts:
+        disposition = 'form-data; name="{}"'.format(name)
+        if filename is not None:
+            disposition += '; filename="{}"'.format(filename)
+        encoded += '--{}\r\nContent-Disposition: {}\r\n\r\n'.format(BOUNDARY, disposition).encode()
+        encoded += data + b'\r\n'
+    return encoded + '--{}--\r\n'.format(BOUNDARY).encode()
+
+
+def uploads(data, max_file_size=1000, chunk_size=64 * 1024):
+    return list(iter_uploads(io.BytesIO(data), CONTENT_TYPE, max_file_size, chunk_size))
+
+
+FILES = body(('file', 'a.jpg', b'a' * 100), ('submit', None, b'Average'), ('file', 'b.jpg', b'b' * 300))
+
+
+@pytest.mark.parametrize('chunk_size', [7, 64 * 1024])
+def test_files_are_read_in_order(chunk_size):
+    assert uploads(FILES, chunk_size=chunk_size) == [('a.jpg', b'a' * 100), ('b.jpg', b'b' * 300)]
+
+
+@pytest.mark.parametrize('chunk_size', [7, 64 * 1024])
+def test_files_over_the_limit_are_not_kept(chunk_size):
+    assert uploads(FILES, max_file_size=300, chunk_size=chunk_size) == [('a.jpg', b'a' * 100), ('b.jpg', b'b' * 300)]
+    assert uploads(FILES, max_file_size=299, chunk_size=chunk_size) == [('a.jpg', b'a' * 100), ('b.jpg', None)]
+
+
+def test_filename_is_given_as_sent():
+    # Made safe by the website, with secure_filename and unique_path
+    assert uploads(body(('file', '../../x.jpg', b'x'))) == [('../../x.jpg', b'x')]
+    assert uploads(body(('file', '', b'x'))) == [('', b'x')]
+
+
+@pytest.mark.parametrize('cut, count', [(10, 0), (150, 0), (250, 1), (530, 1), (len(FILES) - 5, 1)])
+def test_cut_off_body_yields_only_whole_files(cut, count):
+    # b.jpg only counts as whole once the boundary after it is in
+    assert uploads(FILES[:cut], chunk_size=7) == [('a.jpg', b'a' * 100), ('b.jpg', b'b' * 300)][:count]
+
+
+def test_other_content_types_have_no_files():
+    assert list(iter_uploads(io.BytesIO(FILES), 'application/octet-stream', 1000)) == []
+    assert list(iter_uploads(io.BytesIO(FILES), 'multipart/form-data', 1000)) == []
@@ -0,0 +1,72 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_workspace.py
+'''
+This script tests the workspaces of the website: that IDs
+from requests cannot point outside the root, that uploads
+whose safe names collide are all kept, and that workspaces
+are removed once they have not been touched for a while.
+'''
+import os
+import time
+from werkzeug.utils import secure_filename
+from workspace import collect_garbage, content_address, create_workspace, unique_path, workspace_path
+
+
+def test_create_workspace(tmp_path):
+    root = str(tmp_path / 'workspaces')
+    workspace = create_workspace(root)
+    assert workspace != create_workspace(root)
+    assert os.path.isdir(workspace_path(root, workspace, 'faces'))
+    assert os.path.isdir(workspace_path(root, workspace, 'output'))
+
+
+def test_workspace_path_refuses_other_ids(tmp_path):
+    root = str(tmp_path)
+    workspace = create_workspace(root)
+    assert workspace_path(root, workspace) == os.path.join(root, workspace)
+    for other in ('', None, '..', '../' + workspace, workspace.upper(), 'f' * 32):
+        assert workspace_path(root, other) is None
+
+
+def test_unsafe_names_are_made_safe_and_kept_apart(tmp_path):
+    names = ['face.jpg', '../face.jpg', '/etc/face.jpg', 'face.jpg']
+    paths = []
+    for name in names:
+        path = unique_path(str(tmp_path), secure_filename(name))
+        open(path, 'w').close()
+        paths.append(path)
+    assert [os.path.basename(path) for path in paths] == ['face.jpg', 'face_1.jpg', 'etc_face.jpg', 'face_2.jpg']
+    assert all(os.path.dirname(path) == str(tmp_path) for path in paths)
+
+
+def test_content_address(tmp_path):
+    first, second = tmp_path / 'a.png', tmp_path / 'b.png'
+    first.write_bytes(b'image')
+    second.write_bytes(b'image')
+    path = content_address(str(first))
+    assert os.path.basename(path).endswith('.png')
+    assert content_address(str(second)) == path
+    assert os.listdir(str(tmp_path)) == [os.path.basename(path)]
+
+
+def age(path, seconds):
+    """Sets the modification time of a path to some seconds ago"""
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_collect_garbage_removes_old_workspaces(tmp_path):
+    root = str(tmp_path)
+    old, new, touched = create_workspace(root), create_workspace(root), create_workspace(root)
+    for workspace in (old, touched):
+        for part in ('faces', 'output', ''):
+            age(os.path.join(root, workspace, part), 120)
+    # Something was saved in its output since
+    age(os.path.join(root, touched, 'output'), 10)
+    os.mkdir(os.path.join(root, 'other'))
+    age(os.path.join(root, 'other'), 120)
+    assert collect_garbage(root, 60) == [old]
+    assert sorted(os.listdir(root)) == sorted([new, touched, 'other'])
+    assert collect_garbage(root, 1000) == []
+    assert collect_garbage(str(tmp_path / 'missing'), 60) == []
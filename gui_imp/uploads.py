@@ -0,0 +1,85 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# uploads.py
+'''
+This script takes care of reading uploaded images straight
+from the request stream. The multipart body is parsed as it
+arrives, and each file is handed over as soon as its last
+byte is in, so that work on it can start while the rest of
+the upload is still arriving.
+It contains one function:
+    iter_uploads
+
+Sources:
+    https://werkzeug.palletsprojects.com/en/latest/
+'''
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, File, Field, Data, Epilogue
+
+
+def iter_uploads(stream, content_type, max_file_size, chunk_size=64 * 1024):
+    """iter_uploads is a generator yielding each file of a
+    multipart/form-data request body as soon as it has been
+    read in full.
+
+    **Parameters**
+    stream: file-like
+        The request body, e.g. flask.request.stream. Its size is
+        limited by Flask's MAX_CONTENT_LENGTH setting.
+    content_type: str
+        The Content-Type header of the request
+    max_file_size: int
+        The largest file, in bytes, that is read in. The rest of
+        a larger file is skipped without being kept in memory.
+    chunk_size: int
+        The number of bytes read from the stream at a time
+
+    **Returns**
+    (filename, data): tuple
+        The filename given by the client and the bytes of the
+        file, or None instead of the bytes if it was too large
+    """
+    mimetype, options = parse_options_header(content_type)
+    if mimetype != 'multipart/form-data' or 'boundary' not in options:
+        return
+    decoder = MultipartDecoder(options['boundary'].encode())
+    filename = None
+    parts = []
+    size = 0
+    ended = False
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError:
+            # The body ended before the closing boundary
+            return
+        if isinstance(event, NeedData):
+            if ended:
+                # The body ended before the closing boundary
+                return
+            data = stream.read(chunk_size)
+            ended = not data
+            decoder.receive_data(data if data else None)
+            continue
+        if isinstance(event, File):
+            filename = event.filename or ''
+            parts = []
+            size = 0
+        elif isinstance(event, Field):
+            filename = None
+        elif isinstance(event, Data):
+            if filename is not None:
+                size += len(event.data)
+                if size <= max_file_size:
+                    parts.append(event.data)
+                else:
+                    parts = []
+                if not event.more_data:
+                    yield filename, b''.join(parts) if size <= max_file_size else None
+                    filename = None
+        elif isinstance(event, Epilogue):
+            return
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,161 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# workspace.py
+'''
+This script takes care of the workspaces of the website.
+Every upload gets its own directory, holding the uploaded
+images in faces/ and the averaged image in output/, so that
+requests running at the same time never share files.
+Workspaces that have not been touched for a while are
+removed by collect_garbage.
+Output images are renamed after a hash of their contents by
+content_address, so that a URL always names the same image
+and browsers can cache it for good.
+It contains five functions:
+    create_workspace
+    workspace_path
+    unique_path
+    content_address
+    collect_garbage
+
+Sources:
+    https://docs.python.org/3/library/shutil.html
+'''
+import os
+import re
+import time
+import uuid
+import shutil
+import hashlib
+
+# Workspace IDs are uuid4 hex strings. Anything else is refused,
+# so an ID from a request can never point outside the root.
+_ID = re.compile('[0-9a-f]{32}')
+
+
+def create_workspace(root):
+    """create_workspace creates a new, empty workspace.
+
+    **Parameters**
+    root: str
+        The directory holding all workspaces. It is
+        created if it does not already exist.
+
+    **Returns**
+    workspace: str
+        The ID of the new workspace
+    """
+    workspace = uuid.uuid4().hex
+    os.makedirs(os.path.join(root, workspace, 'faces'))
+    os.makedirs(os.path.join(root, workspace, 'output'))
+    return workspace
+
+
+def workspace_path(root, workspace, *parts):
+    """workspace_path returns the path of a workspace,
+    or of a file or directory inside it.
+
+    **Parameters**
+    root: str
+        The directory holding all workspaces
+    workspace: str
+        The ID of the workspace
+    parts: str
+        Path components inside the workspace, e.g. 'faces'
+
+    **Returns**
+    path: str
+        The path, or None if the ID is not valid or
+        the workspace does not exist
+    """
+    if not workspace or not _ID.fullmatch(workspace):
+        return None
+    if not os.path.isdir(os.path.join(root, workspace)):
+        return None
+    return os.path.join(root, workspace, *parts)
+
+
+def unique_path(directory, filename):
+    """unique_path returns a path in a directory for a
+    file that is not taken yet, so that two uploads whose
+    names are made the same by secure_filename, e.g. names
+    in other scripts, do not overwrite each other. A counter
+    is added to the name if it is taken.
+
+    **Parameters**
+    directory: str
+        The directory the file is saved in
+    filename: str
+        The name of the file, already made safe
+
+    **Returns**
+    path: str
+        The path of the file, e.g. directory/face_2.jpg if
+        face.jpg and face_1.jpg are taken
+    """
+    stem, extension = os.path.splitext(filename)
+    path = os.path.join(directory, filename)
+    counter = 0
+    while os.path.exists(path):
+        counter += 1
+        path = os.path.join(directory, '{}_{}{}'.format(stem, counter, extension))
+    return path
+
+
+def content_address(path):
+    """content_address renames a file after a hash of its
+    contents, keeping it in the same directory and keeping
+    its extension.
+
+    **Parameters**
+    path: str
+        The filepath of the file
+
+    **Returns**
+    path: str
+        The new filepath of the file
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    directory = os.path.dirname(path)
+    extension = os.path.splitext(path)[1]
+    target = os.path.join(directory, digest[:32] + extension)
+    os.replace(path, target)
+    return target
+
+
+def collect_garbage(root, ttl):
+    """collect_garbage removes the workspaces in which
+    nothing has been modified for longer than ttl seconds.
+
+    **Parameters**
+    root: str
+        The directory holding all workspaces
+    ttl: float
+        The age in seconds after which a workspace is removed
+
+    **Returns**
+    removed: list
+        The IDs of the workspaces removed
+    """
+    if not os.path.isdir(root):
+        return []
+    removed = []
+    cutoff = time.time() - ttl
+    for entry in os.scandir(root):
+        if not entry.is_dir() or not _ID.fullmatch(entry.name):
+            continue
+        try:
+            modified = [entry.stat().st_mtime]
+            modified += [sub.stat().st_mtime for sub in os.scandir(entry.path) if sub.is_dir()]
+        except OSError:
+            # Removed by another request in the meantime
+            continue
+        if max(modified) < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed.append(entry.name)
+    return removed
+
+
+if __name__ == '__main__':
+    pass
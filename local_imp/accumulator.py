@@ -0,0 +1,205 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# accumulator.py
+'''
+This script takes care of averaging faces incrementally.
+Rather than warping every image again whenever one is added,
+a FaceAccumulator keeps running sums of the warped images and
+of the landmarks, so adding an image costs one warp and the
+average is a single divide. The images are warped to a fixed
+reference mesh, i.e. the template landmarks and their Delaunay
+triangulation, which can be frozen. Otherwise the mesh is moved
+to the mean landmarks from time to time and the images warped
+again, so the average stays close to what averager.py gives.
+The sums are kept as integers in fixed point, so removing an
+image takes away exactly what adding it put in, and sums can
+be combined in any order with the same result.
+It contains one class:
+    FaceAccumulator
+
+Sources:
+    https://github.com/spmallick/learnopencv/tree/master/FaceAverage
+'''
+import numpy as np
+import cv2
+from scale import width, height, eye_transforms, scale_landmarks
+from transform import calculateDelaunayTriangles, remap_plan, warp_image
+
+# The sums hold values scaled by 2**FRACTION_BITS and rounded
+FRACTION_BITS = 16
+FIXED = 1 << FRACTION_BITS
+
+
+class FaceAccumulator(object):
+    """FaceAccumulator keeps a running average of faces.
+
+    **Parameters**
+    template: numpy array
+        The (76, 2) reference landmarks in the common space,
+        e.g. the pointsAvg of an earlier run. Default is None,
+        in which case the landmarks of the first image are used.
+    frozen: bool
+        Whether the template is kept as it is. Default is False.
+    load: function
+        Called with the source given to add, returns the image
+        again, so that the images can be warped again when the
+        template moves. Default is None, which never moves it.
+    rewarp_growth: float
+        The template is moved to the mean landmarks whenever the
+        number of images has grown by this factor since it last
+        moved, so each image is warped again only a few times
+        over. Default is 2.
+    """
+
+    def __init__(self, template=None, frozen=False, load=None, rewarp_growth=2.0):
+        self.frozen = frozen
+        self.load = load
+        self.rewarp_growth = rewarp_growth
+        self.count = 0
+        self.image_sum = np.zeros((height, width, 3), np.int64)
+        self.landmark_sum = None
+        self.sources = {}
+        self._rewarped_at = 0
+        self.template = None
+        if template is not None:
+            self.set_template(template)
+
+    def set_template(self, template, dt=None):
+        """set_template sets the reference landmarks the
+        images are warped to, and triangulates them. It does
+        not warp the images already added, see rewarp.
+
+        **Parameters**
+        template: numpy array
+            The (76, 2) reference landmarks
+        dt: list
+            The triangulation of the template, e.g. one saved
+            with it. Default is None, which triangulates it.
+
+        **Returns**
+        None
+        """
+        self.template = np.array(template, np.float32)
+        self.dt = calculateDelaunayTriangles(self.template) if dt is None else [tuple(int(k) for k in t) for t in dt]
+        self.plan = remap_plan(self.template, self.dt, width, height)
+
+    def freeze(self):
+        """freeze keeps the template as it is from now on."""
+        self.frozen = True
+
+    def _contribution(self, image, landmarks):
+        """Returns the fixed point warped image and the
+        common space landmarks of one face"""
+        tforms = eye_transforms([landmarks])
+        points = scale_landmarks([image], [landmarks], tforms)[1][0]
+        if self.template is None:
+            self.set_template(points)
+        scaled = cv2.warpAffine(image, tforms[0], (width, height))
+        warped = warp_image(scaled, points, self.template, self.dt, self.plan, width, height)
+        return np.rint(warped * FIXED).astype(np.int64), np.rint(np.float64(points) * FIXED).astype(np.int64)
+
+    def add(self, image, landmarks, source=None):
+        """add adds a face to the average.
+
+        **Parameters**
+        image: numpy array
+            The BGR image, float32 in [0, 1] or uint8
+        landmarks: list
+            The 68 (x, y) landmarks of the face in the image
+        source: hashable
+            Where the image came from, e.g. its filename and
+            the index of the face, passed to load when the
+            images are warped again. Each face needs its own.
+            Default is None, in which case the images are not
+            warped again once this face is added.
+
+        **Returns**
+        None
+        """
+        if source is not None and source in self.sources:
+            raise ValueError("A face from {!r} has already been added.".format(source))
+        pixels, points = self._contribution(image, landmarks)
+        self.image_sum += pixels
+        self.landmark_sum = points if self.landmark_sum is None else self.landmark_sum + points
+        self.count += 1
+        if source is not None:
+            self.sources[source] = landmarks
+        if (not self.frozen and self.load is not None and len(self.sources) == self.count
+                and self.count >= max(2, self._rewarped_at * self.rewarp_growth)):
+            self.rewarp()
+
+    def remove(self, image, landmarks, source=None):
+        """remove takes a face added earlier out of the
+        average again. The image and landmarks must be the
+        ones it was added with.
+
+        **Parameters**
+        image: numpy array
+            The image the face was added with
+        landmarks: list
+            The landmarks the face was added with
+        source: hashable
+            The source the face was added with. Default is None.
+
+        **Returns**
+        None
+        """
+        pixels, points = self._contribution(image, landmarks)
+        self.image_sum -= pixels
+        self.landmark_sum -= points
+        self.count -= 1
+        self.sources.pop(source, None)
+
+    def rewarp(self):
+        """rewarp moves the template to the mean landmarks of
+        the faces added so far and warps all of them again.
+        It needs load, and a source for every face.
+
+        **Parameters**
+        None
+
+        **Returns**
+        None
+        """
+        if self.load is None or len(self.sources) != self.count:
+            raise ValueError("Every face needs a source and a load function to be warped again.")
+        self.set_template(self.landmarks())
+        self.image_sum[:] = 0
+        self.landmark_sum[:] = 0
+        for source, landmarks in self.sources.items():
+            pixels, points = self._contribution(self.load(source), landmarks)
+            self.image_sum += pixels
+            self.landmark_sum += points
+        self._rewarped_at = self.count
+
+    def landmarks(self):
+        """landmarks returns the mean landmarks of the faces
+        added so far, in the common space.
+
+        **Parameters**
+        None
+
+        **Returns**
+        pointsAvg: numpy array
+            The (76, 2) mean landmarks
+        """
+        return np.float32(self.landmark_sum / (self.count * FIXED))
+
+    def result(self):
+        """result returns the average face.
+
+        **Parameters**
+        None
+
+        **Returns**
+        output: numpy array
+            The average face, float32 in [0, 1], as
+            returned by transform.image_transform
+        """
+        if self.count == 0:
+            raise ValueError("No faces have been added.")
+        return np.float32(self.image_sum / (self.count * FIXED))
+
+
+if __name__ == '__main__':
+    pass
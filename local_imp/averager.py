@@ -12,14 +12,21 @@ Sources:
     3. stack exchange
 '''
 import cv2
+import sys
+import json
+import argparse
 import numpy as np
-from process_images import face_check, process_images
-from landmark_map import find_landmarks
-from scale import scale_images, scale_landmarks
-from transform import calculateDelaunayTriangles, warpTriangle, image_transform
+from ingest import ingest_images, iter_images, load_image
+from scale import eye_transforms, scale_image, scale_images, iter_scaled_images, scale_landmarks
+from transform import calculateDelaunayTriangles, warpTriangle, image_transform, parallel_image_transform
+from progress import Progress
+from metrics import summary
+from checkpoint import average_checkpointed
 
 
-def main(image_path):
+def main(image_path, cache_path='landmark_cache.db', workers=1, stream=False, roi=False,
+         min_face=0.1, progress=None, detector='hog', boxes=None, checkpoint_path=None, resume=False,
+         checkpoint_every=100, show=True):
     """ Main runs the program to average the
     faces in a given file path, displaying
     the 'average' face at the end.
@@ -29,28 +36,146 @@ def main(image_path):
     image_path: str
         A string indicating the filepath containing
         the images to be 'averaged'
+    cache_path: str
+        The filepath of the landmark cache database, so that
+        faces found in earlier runs are not searched for again.
+        Default is 'landmark_cache.db'. Use None to disable it.
+    workers: int
+        The number of processes used to find faces and landmarks,
+        and to warp the faces. Default is 1.
+    stream: bool
+        If True, only the landmarks are kept after the first pass
+        and the images are then loaded, scaled and warped one at a
+        time, so memory use does not grow with the number of images.
+        Default is False.
+    roi: bool
+        If True, only the part of each image around the face that
+        ends up in the output is kept, as uint8 until it is warped.
+        Default is False.
+    min_face: float
+        The smallest face, as a fraction of the shorter side of
+        an image, looked for on a scaled down copy before the
+        detector falls back to upsampling. Default is 0.1. Use
+        None to always search the full resolution image.
+    progress: Progress
+        Reports each stage, and the images it has done, see
+        progress.Progress. Default is None, which only prints
+        the stages.
+    detector: str
+        The face detector, one of 'hog' (dlib, the default),
+        'haar' or 'lbp' (OpenCV's faster cascades) or 'boxes'.
+    boxes: dict
+        For the 'boxes' detector, the boxes of the faces in each
+        image, by file name, as lists of (left, top, right, bottom)
+    checkpoint_path: str
+        If given, the images are averaged in two passes that never
+        hold more than one image in memory, and the state of the
+        run is saved to this file as it goes, see
+        checkpoint.average_checkpointed. Default is None.
+    resume: bool
+        Whether to carry on from the checkpoint. Default is False.
+    checkpoint_every: int
+        The number of images done between checkpoints.
+        Default is 100.
+    show: bool
+        Whether to display the average face. Default is True.
 
     **Returns**
 
-    None
+    output: numpy array
+        The average face
     """
+    if progress is None:
+        progress = Progress()
     print('Opening {} and checking for faces...'.format(image_path))
+    if checkpoint_path:
+        output = average_checkpointed(image_path, checkpoint_path, resume, checkpoint_every,
+                                      cache_path=cache_path, min_face=min_face, detector=detector,
+                                      boxes=boxes, workers=workers, progress=progress)
+        if output is None:
+            sys.exit()
+        progress.finish()
+        print('Success!')
+        if show:
+            cv2.imshow('image', output)
+            cv2.waitKey(0)
+        return output
     print('Processing images...')
-    face_check(image_path)
-    images = process_images(image_path)
-    print('Finding facial landmarks...')
-    allandmarks = find_landmarks(image_path)
-    print('Scaling images to common space...')
-    scaled_images = scale_images(images, allandmarks)
-    pointsAvg, pointsNorm = scale_landmarks(images, allandmarks)
-    print('Triangulating points...')
+    progress.begin('landmarks', 'Finding facial landmarks...')
+    records = ingest_images(image_path, cache_path=cache_path, workers=workers,
+                            keep_pixels=not stream, roi=roi, min_face=min_face, progress=progress,
+                            detector=detector, boxes=boxes)
+    allandmarks = [record.landmarks for record in records]
+    progress.begin('scaling', 'Scaling images to common space...', len(records))
+    tforms = eye_transforms(allandmarks)
+    pointsAvg, pointsNorm = scale_landmarks(records, allandmarks, tforms)
+    if stream and workers > 1:
+        # Each worker loads and scales the images it warps
+        scaled_images = None
+        load = lambda i: scale_image(load_image(records[i]), tforms[i])
+    elif stream:
+        scaled_images = iter_scaled_images(iter_images(records), tforms)
+    else:
+        images = [record.image for record in records]
+        scaled_images = scale_images(images, allandmarks, tforms)
+    progress.begin('triangulating', 'Triangulating points...')
     dt = calculateDelaunayTriangles(np.array(pointsAvg))
-    print('Averaging faces...')
-    output = image_transform(scaled_images, pointsNorm, pointsAvg, dt)
+    progress.begin('averaging', 'Averaging faces...', len(records))
+    if workers > 1:
+        if scaled_images is not None:
+            load = scaled_images.__getitem__
+        output = parallel_image_transform(load, pointsNorm, pointsAvg, dt, engine='remap', workers=workers,
+                                          progress=progress)
+    else:
+        output = image_transform(scaled_images, pointsNorm, pointsAvg, dt, engine='remap', progress=progress)
+    progress.finish()
     print('Success!')
-    cv2.imshow('image', output)
-    cv2.waitKey(0)
+    if show:
+        cv2.imshow('image', output)
+        cv2.waitKey(0)
+    return output
 
 if __name__ == '__main__':
-    image_path = input("Please enter the name of a folder containing images: ")
-    main(image_path)
+    parser = argparse.ArgumentParser(description='Average the faces in a folder of images.')
+    parser.add_argument('image_path', nargs='?',
+                        help='the folder containing the images, asked for if not given')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='the number of processes used to find and warp faces')
+    parser.add_argument('--cache', default='landmark_cache.db',
+                        help='the landmark cache database, or "" to disable it')
+    parser.add_argument('--stream', action='store_true',
+                        help='load the images one at a time to save memory')
+    parser.add_argument('--roi', action='store_true',
+                        help='only keep the part of each image around the face')
+    parser.add_argument('--detector', choices=('hog', 'haar', 'lbp'), default='hog',
+                        help='the face detector: dlib HOG (default), or the faster OpenCV cascades')
+    parser.add_argument('--boxes', metavar='PATH',
+                        help='a JSON file of face boxes by file name, used instead of a detector')
+    parser.add_argument('--checkpoint', metavar='PATH',
+                        help='average in two low memory passes, saving the state of the run here')
+    parser.add_argument('--checkpoint-every', type=int, default=100,
+                        help='the number of images done between checkpoints')
+    parser.add_argument('--resume', action='store_true', help='carry on from the checkpoint')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='save a JSON summary of the time and memory of each stage, or - to print it')
+    args = parser.parse_args()
+    image_path = args.image_path
+    if image_path is None:
+        image_path = input("Please enter the name of a folder containing images: ")
+    detector, boxes = args.detector, None
+    if args.boxes:
+        with open(args.boxes) as f:
+            detector, boxes = 'boxes', json.load(f)
+    progress = Progress()
+    output = main(image_path, cache_path=args.cache or None, workers=args.workers, stream=args.stream,
+                  roi=args.roi, progress=progress, detector=detector, boxes=boxes,
+                  checkpoint_path=args.checkpoint, resume=args.resume, checkpoint_every=args.checkpoint_every,
+                  show=False)
+    # Saved before the window is shown, since that waits for a key
+    if args.metrics == '-':
+        print(json.dumps(summary(progress.event()), indent=2))
+    elif args.metrics:
+        with open(args.metrics, 'w') as f:
+            json.dump(summary(progress.event()), f, indent=2)
+    cv2.imshow('image', output)
+    cv2.waitKey(0)
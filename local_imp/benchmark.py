@@ -0,0 +1,283 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# benchmark.py
+'''
+This script times each stage of the averager, so that a
+change to one of them can be checked for speed. It makes up
+its own images and 68 point landmark sets, of any number and
+resolution, so it runs without the dlib model or any photos.
+If the predictor model file is present, finding faces and
+landmarks is timed as well. The results are saved as JSON,
+and can be compared with the results of an earlier commit.
+It contains six functions:
+    synthetic_landmarks
+    synthetic_images
+    time_stage
+    benchmark_stages
+    benchmark_detection
+    compare
+
+Sources:
+    https://docs.python.org/3/library/time.html#time.perf_counter
+'''
+import os
+import json
+import glob
+import time
+import platform
+import argparse
+import subprocess
+import cv2
+import numpy as np
+from scale import eye_transforms, scale_images, scale_landmarks
+from transform import calculateDelaunayTriangles, image_transform
+
+# A rough 68 point face in a unit box, in the order of dlib's model:
+# jaw, eyebrows, nose, eyes and mouth
+_angles = np.radians([180, 120, 60, 0, 300, 240])
+_TEMPLATE = np.concatenate([
+    np.stack([0.5 - 0.5 * np.cos(np.linspace(0, np.pi, 17)), 0.3 + 0.7 * np.sin(np.linspace(0, np.pi, 17))], 1),
+    np.stack([np.linspace(0.1, 0.4, 5), 0.2 - 0.05 * np.sin(np.linspace(0, np.pi, 5))], 1),
+    np.stack([np.linspace(0.6, 0.9, 5), 0.2 - 0.05 * np.sin(np.linspace(0, np.pi, 5))], 1),
+    np.stack([np.full(4, 0.5), np.linspace(0.3, 0.55, 4)], 1),
+    np.stack([np.linspace(0.4, 0.6, 5), np.full(5, 0.62)], 1),
+    np.stack([0.3 + 0.08 * np.cos(_angles), 0.35 - 0.03 * np.sin(_angles)], 1),
+    np.stack([0.7 + 0.08 * np.cos(_angles), 0.35 - 0.03 * np.sin(_angles)], 1),
+    np.stack([0.5 + 0.18 * np.cos(np.radians(np.arange(180, -180, -30))),
+              0.8 - 0.07 * np.sin(np.radians(np.arange(180, -180, -30)))], 1),
+    np.stack([0.5 + 0.12 * np.cos(np.radians(np.arange(180, -180, -45))),
+              0.8 - 0.03 * np.sin(np.radians(np.arange(180, -180, -45)))], 1),
+])
+
+
+def synthetic_landmarks(count, width, height, seed=0):
+    """synthetic_landmarks makes up facial landmarks for
+    a number of images, each a slightly moved, turned,
+    scaled and jittered copy of the same face.
+
+    **Parameters**
+    count: int
+        The number of landmark sets
+    width: int
+        The width of the images
+    height: int
+        The height of the images
+    seed: int
+        The seed of the random numbers. Default is 0.
+
+    **Returns**
+    alllandmarks: list
+        A list of lists of 68 (x, y) tuples, one for each image
+    """
+    random = np.random.default_rng(seed)
+    alllandmarks = []
+    for _ in range(count):
+        size = min(width, height) * random.uniform(0.4, 0.6)
+        angle = np.radians(random.uniform(-10, 10))
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        points = (_TEMPLATE - 0.5 + random.normal(0, 0.005, _TEMPLATE.shape)) * size
+        center = (width / 2 + random.uniform(-0.1, 0.1) * width, height / 2 + random.uniform(-0.1, 0.1) * height)
+        points = np.matmul(points, rotation.T) + center
+        alllandmarks.append([(int(x), int(y)) for x, y in points])
+    return alllandmarks
+
+
+def synthetic_images(count, width, height, seed=0):
+    """synthetic_images makes up images, as the averager
+    holds them, i.e. float32 with values from 0 to 1.
+
+    **Parameters**
+    count: int
+        The number of images
+    width: int
+        The width of the images
+    height: int
+        The height of the images
+    seed: int
+        The seed of the random numbers. Default is 0.
+
+    **Returns**
+    images: list
+        A list of (height, width, 3) numpy arrays
+    """
+    random = np.random.default_rng(seed)
+    # Smooth noise, so that interpolation is not trivially cheap
+    small = random.random((count, max(1, height // 16), max(1, width // 16), 3), np.float32)
+    return [cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR) for image in small]
+
+
+def time_stage(function, repeat=3):
+    """time_stage runs a function a number of times.
+
+    **Parameters**
+    function: function
+        The function to time, called without arguments
+    repeat: int
+        The number of times it is run. Default is 3.
+
+    **Returns**
+    best: float
+        The shortest time taken, in seconds
+    median: float
+        The median time taken, in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times), float(np.median(times))
+
+
+def benchmark_stages(counts, sizes, engines=('remap',), repeat=3):
+    """benchmark_stages times each stage of the averager
+    that runs after the landmarks are found, on made up
+    images and landmarks.
+
+    **Parameters**
+    counts: list
+        The numbers of images to time the stages for
+    sizes: list
+        The resolutions of the images to time the stages
+        for, as the length of their longer side. Images
+        are 4:3.
+    engines: tuple
+        The warp engines of image_transform to time.
+        Default is ('remap',).
+    repeat: int
+        The number of times each stage is run. Default is 3.
+
+    **Returns**
+    results: list
+        A list of dicts, one for each stage, number
+        of images and resolution
+    """
+    results = []
+    for size in sizes:
+        width, height = size, size * 3 // 4
+        for count in counts:
+            alllandmarks = synthetic_landmarks(count, width, height)
+            images = synthetic_images(count, width, height)
+            tforms = eye_transforms(alllandmarks)
+            pointsAvg, pointsNorm = scale_landmarks(images, alllandmarks, tforms)
+            dt = calculateDelaunayTriangles(np.array(pointsAvg))
+            scaled = scale_images(images, alllandmarks, tforms)
+            stages = [('similarity_transforms', lambda: eye_transforms(alllandmarks)),
+                      ('scale_landmarks', lambda: scale_landmarks(images, alllandmarks, tforms)),
+                      ('scale_images', lambda: scale_images(images, alllandmarks, tforms)),
+                      ('calculateDelaunayTriangles', lambda: calculateDelaunayTriangles(np.array(pointsAvg)))]
+            for engine in engines:
+                stages.append(('image_transform[{}]'.format(engine),
+                               lambda engine=engine: image_transform(scaled, pointsNorm, pointsAvg, dt,
+                                                                     engine=engine)))
+            for stage, function in stages:
+                best, median = time_stage(function, repeat)
+                print('{:<34} {:>5} images {:>5}px {:10.4f}s'.format(stage, count, size, best))
+                results.append({'stage': stage, 'images': count, 'size': size,
+                                'seconds': best, 'median_seconds': median})
+    return results
+
+
+def benchmark_detection(predictorfp, images, repeat=3):
+    """benchmark_detection times finding the faces and
+    landmarks in a set of images. It needs dlib and the
+    predictor model file.
+
+    **Parameters**
+    predictorfp: str
+        The filepath name containing the predictor file
+    images: list
+        A list of uint8 BGR images, as read by cv2.imread
+    repeat: int
+        The number of times each image is searched.
+        Default is 3.
+
+    **Returns**
+    results: list
+        A list of dicts, one for detection alone and one
+        for detection together with the landmarks
+    """
+    from detect import detect_faces
+    from ingest import find_faces
+    from models import warm
+    warm(predictorfp)
+    results = []
+    rgb = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images]
+    stages = [('detect_faces', lambda: [detect_faces(image) for image in rgb]),
+              ('find_faces', lambda: [find_faces(image, predictorfp) for image in images])]
+    size = max(max(image.shape[:2]) for image in images)
+    for stage, function in stages:
+        best, median = time_stage(function, repeat)
+        print('{:<34} {:>5} images {:>5}px {:10.4f}s'.format(stage, len(images), size, best))
+        results.append({'stage': stage, 'images': len(images), 'size': size,
+                        'seconds': best, 'median_seconds': median})
+    return results
+
+
+def compare(results, baseline):
+    """compare prints how much faster or slower each
+    stage is than in an earlier run.
+
+    **Parameters**
+    results: list
+        The results of this run, see benchmark_stages
+    baseline: list
+        The results of the earlier run
+
+    **Returns**
+    None
+    """
+    earlier = {(r['stage'], r['images'], r['size']): r['seconds'] for r in baseline}
+    print('Compared with the baseline:')
+    for r in results:
+        before = earlier.get((r['stage'], r['images'], r['size']))
+        if before:
+            print('{:<34} {:>5} images {:>5}px {:8.2f}x'.format(r['stage'], r['images'], r['size'],
+                                                                before / r['seconds']))
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time each stage of the averager.')
+    parser.add_argument('--counts', type=int, nargs='+', default=[10, 50],
+                        help='the numbers of images to time each stage for')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[600, 1600],
+                        help='the longer sides of the images, in pixels')
+    parser.add_argument('--engines', nargs='+', default=['remap', 'triangle'],
+                        help='the warp engines of image_transform to time')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of times each stage is run')
+    parser.add_argument('--predictor', default='shape_predictor_68_face_landmarks.dat',
+                        help='the predictor model, timed only if the file is present')
+    parser.add_argument('--images', help='a folder of face images to time detection on')
+    parser.add_argument('--output', default='benchmark.json', help='where to save the results')
+    parser.add_argument('--baseline', help='the results of an earlier run to compare with')
+    args = parser.parse_args()
+    results = benchmark_stages(args.counts, args.sizes, args.engines, args.repeat)
+    if os.path.exists(args.predictor):
+        if args.images:
+            faces = [cv2.imread(file) for file in sorted(glob.glob(os.path.join(args.images, '*')))]
+            faces = [image for image in faces if image is not None]
+        else:
+            faces = [np.uint8(image * 255) for image in synthetic_images(max(args.counts), max(args.sizes),
+                                                                       max(args.sizes) * 3 // 4)]
+        results += benchmark_detection(args.predictor, faces, args.repeat)
+    else:
+        print("No predictor model found, so detection and landmarks are not timed.")
+    with open(args.output, 'w') as f:
+        json.dump({'commit': _commit(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'opencv': cv2.__version__,
+                   'machine': platform.machine(),
+                   'results': results}, f, indent=2)
+    print('Results saved to {}'.format(args.output))
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f)['results'])
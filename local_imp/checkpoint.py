@@ -0,0 +1,355 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# checkpoint.py
+'''
+This script takes care of averaging very large sets of
+images in a way that can be stopped and resumed. The run
+has two passes. The first finds the landmarks of every
+image, and the second warps the faces one at a time into a
+FaceAccumulator whose template is frozen at the mean
+landmarks, which gives the same average as averager.py
+without holding the images in memory. The outcome of each
+file in the first pass, i.e. its landmarks or why it was
+skipped, is appended to a log next to the checkpoint as soon
+as it is known. Every so often the rest of the state of the
+run, i.e. the sums of the accumulator, is saved to the
+checkpoint itself, so saving costs the same however many
+files are done. A later run can carry on from the two. Files
+that cannot be read, or have no face, are logged and skipped.
+A file that can no longer be read in the second pass is logged
+as skipped too, and since its landmarks were part of the mean,
+the second pass starts again without it.
+It contains five functions:
+    read_log
+    save_checkpoint
+    load_checkpoint
+    find_faces_logged
+    average_checkpointed
+
+Sources:
+    https://numpy.org/doc/stable/reference/generated/numpy.savez.html
+    https://jsonlines.org/
+'''
+import os
+import glob
+import json
+import hashlib
+import multiprocessing
+from functools import partial
+import numpy as np
+import cv2
+from models import PREDICTOR, warm
+from ingest import detect_file
+from landmark_cache import LandmarkCache
+from scale import eye_transforms, scale_landmarks
+from accumulator import FaceAccumulator
+
+
+def read_log(path):
+    """read_log reads the outcomes of the files done in
+    the first pass. A last line cut short by a run that
+    was killed while writing it is ignored.
+
+    **Parameters**
+    path: str
+        The filepath of the log
+
+    **Returns**
+    records: dict
+        For each file done, in the order they were done, a
+        dict with its 'file' and either its 'faces', a list of
+        the landmarks of each face, or why it was 'skipped'
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            record = json.loads(line)
+            records[record['file']] = record
+    return records
+
+
+def _trim_log(path):
+    """Cuts a last line that was cut short off the log,
+    so that new lines can be appended after it"""
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        # Look back from the end, a block at a time, for the last newline
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        f.truncate(end)
+
+
+def save_checkpoint(path, state):
+    """save_checkpoint saves the state of a run, apart from
+    the log. The checkpoint is written to a temporary file first
+    and then renamed, so a run killed while saving leaves the
+    last checkpoint as it was.
+
+    **Parameters**
+    path: str
+        The filepath of the checkpoint
+    state: dict
+        The state of the run, see load_checkpoint
+
+    **Returns**
+    None
+    """
+    temp = path + '.tmp'
+    empty = np.zeros(0, np.int64)
+    with open(temp, 'wb') as f:
+        np.savez(f,
+                 settings=json.dumps(state['settings']),
+                 digest=state['digest'],
+                 warped=state['warped'],
+                 count=state['count'],
+                 image_sum=state['image_sum'] if state['image_sum'] is not None else empty,
+                 landmark_sum=state['landmark_sum'] if state['landmark_sum'] is not None else empty)
+    os.replace(temp, path)
+
+
+def load_checkpoint(path):
+    """load_checkpoint loads the state of a run.
+
+    **Parameters**
+    path: str
+        The filepath of the checkpoint. The log is read
+        from the same path with '.log' added.
+
+    **Returns**
+    state: dict
+        'settings', the settings of the run; 'records', the
+        outcome of each file done, see read_log; 'digest', which
+        identifies the faces being warped; 'warped', the number
+        of faces added to the accumulator; and 'count',
+        'image_sum' and 'landmark_sum', the sums of the
+        accumulator (None if no face has been warped yet)
+    """
+    with np.load(path) as data:
+        return {'settings': json.loads(str(data['settings'])),
+                'records': read_log(path + '.log'),
+                'digest': str(data['digest']),
+                'warped': int(data['warped']),
+                'count': int(data['count']),
+                'image_sum': data['image_sum'] if data['image_sum'].size else None,
+                'landmark_sum': data['landmark_sum'] if data['landmark_sum'].size else None}
+
+
+def find_faces_logged(file, predictorfp, cache=None, min_face=0.1, detector='hog', boxes=None):
+    """find_faces_logged finds the faces of one file for
+    the first pass, as the record that is logged for it.
+
+    **Parameters**
+    file: str
+        The filepath of the image
+    predictorfp: str
+        The filepath name containing the predictor file
+    cache: LandmarkCache
+        See ingest.detect_file. Default is None.
+    min_face, detector, boxes:
+        See ingest.ingest_images
+
+    **Returns**
+    record: dict
+        The record of the file, see read_log
+    """
+    try:
+        image, faces = detect_file(file, predictorfp, cache, min_face, detector,
+                                   boxes.get(os.path.basename(file)) if boxes else None)
+    except (RuntimeError, cv2.error, ValueError, OSError) as error:
+        return {'file': file, 'skipped': str(error)}
+    if image is None:
+        return {'file': file, 'skipped': 'not a readable image'}
+    if not faces:
+        return {'file': file, 'skipped': 'no face found'}
+    return {'file': file, 'faces': [[list(point) for point in landmarks] for box, landmarks in faces]}
+
+
+# The landmark cache of a first pass worker process
+_worker = {}
+
+
+def _init_worker(predictorfp, cache_path, detector):
+    """Loads the models and opens the cache of a first pass worker"""
+    warm(predictorfp, detector)
+    _worker['cache'] = LandmarkCache(cache_path) if cache_path else None
+
+
+def _find_worker(file, predictorfp, min_face, detector, boxes):
+    """Finds the faces of one file inside a first pass worker"""
+    return find_faces_logged(file, predictorfp, _worker['cache'], min_face, detector, boxes)
+
+
+def _find_all(files, predictorfp, cache_path, workers, min_face, detector, boxes):
+    """Yields the record of each file, in order, with the work
+    spread over a pool of worker processes if workers > 1"""
+    if workers > 1:
+        with multiprocessing.Pool(workers, _init_worker, (predictorfp, cache_path, detector)) as pool:
+            yield from pool.imap(partial(_find_worker, predictorfp=predictorfp, min_face=min_face,
+                                         detector=detector, boxes=boxes), files,
+                                 max(1, min(16, len(files) // (workers * 4))))
+        return
+    cache = LandmarkCache(cache_path) if cache_path else None
+    try:
+        for file in files:
+            yield find_faces_logged(file, predictorfp, cache, min_face, detector, boxes)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def _skip(file, reason):
+    """Reports a file that is left out of the average"""
+    print("Skipping '{}': {}.".format(os.path.basename(file), reason))
+
+
+def _log(log, record):
+    """Appends a record to the log"""
+    log.write(json.dumps(record) + '\n')
+
+
+def _sync(log):
+    """Makes sure the log so far is on disk"""
+    log.flush()
+    os.fsync(log.fileno())
+
+
+def average_checkpointed(image_path, checkpoint_path, resume=False, every=100, predictorfp=PREDICTOR,
+                         cache_path=None, min_face=0.1, detector='hog', boxes=None, workers=1, progress=None):
+    """average_checkpointed averages the faces in the images
+    of a filepath, saving a checkpoint as it goes.
+
+    **Parameters**
+    image_path: str
+        A string indicating the filepath containing
+        the images to be 'averaged'
+    checkpoint_path: str
+        The filepath of the checkpoint. The log is kept at
+        the same path with '.log' added.
+    resume: bool
+        Whether to carry on from the checkpoint, if there is
+        one. Default is False, which starts from the beginning.
+    every: int
+        The number of images done between checkpoints.
+        Default is 100.
+    predictorfp: str
+        The filepath name containing the predictor file
+    cache_path: str
+        The filepath of the landmark cache database.
+        Default is None (no cache).
+    min_face, detector, boxes:
+        See ingest.ingest_images
+    workers: int
+        The number of processes used to find faces and
+        landmarks in the first pass. Default is 1.
+    progress: Progress
+        Reports each pass, see progress.Progress. Default is None.
+
+    **Returns**
+    output: numpy array
+        The average face, as returned by transform.image_transform,
+        or None if fewer than two faces were found
+    """
+    settings = {'image_path': os.path.abspath(image_path), 'min_face': min_face, 'detector': detector}
+    log_path = checkpoint_path + '.log'
+    if resume and os.path.exists(checkpoint_path):
+        if os.path.exists(log_path):
+            _trim_log(log_path)
+        state = load_checkpoint(checkpoint_path)
+        if state['settings'] != settings:
+            raise ValueError("The checkpoint '{}' is of a run with other settings: {}".format(
+                checkpoint_path, state['settings']))
+        print('Resuming from {}: {} images done, {} faces warped.'.format(
+            checkpoint_path, len(state['records']), state['warped']))
+    else:
+        state = {'settings': settings, 'records': {}, 'digest': '', 'warped': 0,
+                 'count': 0, 'image_sum': None, 'landmark_sum': None}
+        open(log_path, 'w').close()
+        save_checkpoint(checkpoint_path, state)
+    records = state['records']
+    files = sorted(glob.glob(os.path.join(settings['image_path'], '*')))
+    new = [file for file in files if file not in records]
+    with open(log_path, 'a') as log:
+        # First pass: the landmarks of every file not done yet
+        if progress is not None:
+            progress.begin('landmarks', 'Finding facial landmarks...', len(files))
+        if state['image_sum'] is None and new:
+            # A missing model should stop the run, not skip every file
+            warm(predictorfp, detector)
+            found = _find_all(new, predictorfp, cache_path, workers, min_face, detector, boxes)
+            for done, record in enumerate(found, 1):
+                if 'skipped' in record:
+                    _skip(record['file'], record['skipped'])
+                records[record['file']] = record
+                _log(log, record)
+                if done % every == 0:
+                    _sync(log)
+                if progress is not None:
+                    progress.update(len(files) - len(new) + done)
+            _sync(log)
+        elif new:
+            print('Images added since the faces were first warped are left out.')
+        while True:
+            faces = [(file, landmarks) for file, record in records.items()
+                     for landmarks in record.get('faces', [])]
+            if len(faces) < 2:
+                print("Fewer than two faces found. At least two are required!")
+                return None
+            digest = hashlib.sha256('\n'.join(file for file, landmarks in faces).encode()).hexdigest()
+            if state['image_sum'] is not None and state['digest'] != digest:
+                print('The faces have changed since they were warped, so they are warped again.')
+                state.update(warped=0, count=0, image_sum=None, landmark_sum=None)
+            state['digest'] = digest
+            # Second pass: warp the faces to the mean landmarks, one at a time
+            alllandmarks = [landmarks for file, landmarks in faces]
+            pointsAvg, pointsNorm = scale_landmarks(None, alllandmarks, eye_transforms(alllandmarks))
+            accumulator = FaceAccumulator(template=pointsAvg, frozen=True)
+            if state['image_sum'] is not None:
+                accumulator.image_sum = state['image_sum']
+                accumulator.landmark_sum = state['landmark_sum']
+                accumulator.count = state['count']
+            if progress is not None:
+                progress.begin('averaging', 'Averaging faces...', len(faces))
+            loaded, image, dropped = None, None, None
+            for index in range(state['warped'], len(faces)):
+                file, landmarks = faces[index]
+                if file != loaded:
+                    loaded, image = file, cv2.imread(file)
+                    image = np.float32(image)/255.0 if image is not None else None
+                if image is None:
+                    dropped = file
+                    break
+                accumulator.add(image, landmarks)
+                state['warped'] = index + 1
+                if state['warped'] % every == 0 or state['warped'] == len(faces):
+                    state['count'] = accumulator.count
+                    state['image_sum'] = accumulator.image_sum
+                    state['landmark_sum'] = accumulator.landmark_sum
+                    save_checkpoint(checkpoint_path, state)
+                if progress is not None:
+                    progress.update(index + 1)
+            if dropped is None:
+                break
+            # Its landmarks are part of the template, so start again without them
+            record = {'file': dropped, 'skipped': 'no longer a readable image'}
+            _skip(dropped, record['skipped'])
+            records[dropped] = record
+            _log(log, record)
+            _sync(log)
+    skipped = sum(1 for record in records.values() if 'skipped' in record)
+    if skipped:
+        print('{} image(s) were skipped, see above.'.format(skipped))
+    return accumulator.result()
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,111 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# detect.py
+'''
+This script takes care of running the face detector.
+Rather than upsampling every full resolution photo, the
+detector is run on a copy scaled down so that the smallest
+face we look for just fills the detector window, and the
+face boxes are mapped back to the full resolution image.
+Only if no face is found does it fall back to upsampling.
+Several detectors can be chosen from, see DETECTORS: dlib's
+HOG detector, which finds the most faces, OpenCV's Haar and
+LBP cascades, which are several times faster on frontal,
+well lit photos, and 'boxes', which uses face boxes supplied
+with the images instead of detecting them. All of them give
+boxes in the same form, for the shape predictor.
+It contains one function:
+    detect_faces
+
+Sources:
+    http://dlib.net/face_detector.py.html
+    https://docs.opencv.org/4.x/db/d28/tutorial_cascade_classifier.html
+    stack overflow
+'''
+import cv2
+from models import get_detector
+
+DETECTORS = ('hog', 'haar', 'lbp', 'boxes')
+
+# Size in pixels of the smallest face dlib's HOG detector finds
+# without upsampling
+DETECTOR_WINDOW = 80
+# Size in pixels the smallest face is scaled to for the cascades.
+# Their windows are 24 pixels, but they miss fewer faces with room
+# to spare.
+CASCADE_WINDOW = 40
+
+
+def detect_faces(image, min_face=0.1, upsample=1, detector='hog', boxes=None):
+    """detect_faces finds the faces in an image.
+
+    **Parameters**
+    image: numpy array
+        The RGB image to search for faces
+    min_face: float
+        The size of the smallest face looked for on the first
+        try, as a fraction of the shorter side of the image.
+        Default is 0.1. Use None to always run the detector on
+        the full resolution image, as before.
+    upsample: int
+        How many times the full resolution image is upsampled
+        when the scaled down image gives no face. Default is 1.
+        Only used by the 'hog' detector.
+    detector: str
+        The detector to use, one of DETECTORS. Default is 'hog'.
+        The shape predictor was trained on the boxes of 'hog',
+        so the landmarks can be a little less accurate with
+        the cascades.
+    boxes: list
+        The (left, top, right, bottom) boxes of the faces,
+        used as they are by the 'boxes' detector
+
+    **Returns**
+    faces: list
+        A list of (left, top, right, bottom) tuples, one for
+        each face, in full resolution image coordinates
+    """
+    if detector == 'boxes':
+        return [tuple(int(v) for v in box) for box in boxes or []]
+    if detector != 'hog':
+        return _detect_cascade(image, min_face, detector)
+    detector = get_detector()
+    height, width = image.shape[:2]
+    scale = 1.0
+    if min_face:
+        scale = min(1.0, DETECTOR_WINDOW / (min_face * min(height, width)))
+    if scale < 1.0:
+        small = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+        # Only upsample the small image if nothing is found at first
+        for times in (0, 1):
+            faces = detector(small, times)
+            if faces:
+                return [(int(d.left() / scale), int(d.top() / scale),
+                         int(d.right() / scale), int(d.bottom() / scale)) for d in faces]
+    faces = detector(image, upsample)
+    return [(d.left(), d.top(), d.right(), d.bottom()) for d in faces]
+
+
+def _detect_cascade(image, min_face, name):
+    """Finds the faces in an RGB image with one of
+    OpenCV's cascades, see detect_faces"""
+    cascade = get_detector(name)
+    gray = cv2.equalizeHist(cv2.cvtColor(image, cv2.COLOR_RGB2GRAY))
+    height, width = gray.shape
+    scale = 1.0
+    if min_face:
+        scale = min(1.0, CASCADE_WINDOW / (min_face * min(height, width)))
+    if scale < 1.0:
+        small = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+        faces = cascade.detectMultiScale(small, scaleFactor=1.1, minNeighbors=5)
+        if len(faces):
+            return [(int(x / scale), int(y / scale), int((x + w) / scale), int((y + h) / scale))
+                    for x, y, w, h in faces]
+    faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+    return [(int(x), int(y), int(x + w), int(y + h)) for x, y, w, h in faces]
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,119 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# landmark_cache.py
+'''
+This script takes care of caching the face boxes and facial
+landmarks found for an image on disk, so that averaging the
+same photos again does not have to run dlib again.
+Entries are keyed by a hash of the image file bytes together
+with the predictor model and the detector parameters used, and
+the least recently used entries are evicted once the cache
+holds more than a set number of entries.
+It contains two functions and one class:
+    model_identity
+    cache_key
+    LandmarkCache
+
+Sources:
+    https://docs.python.org/3/library/sqlite3.html
+    stack overflow
+'''
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+
+def model_identity(predictorfp):
+    """model_identity returns a short string identifying
+    a predictor model file. The name, size and modification
+    time are used rather than the contents, since hashing
+    a ~100 MB model on every run would defeat the cache.
+
+    **Parameters**
+    predictorfp: str
+        The filepath of the predictor model
+
+    **Returns**
+    identity: str
+        A string identifying the model file
+    """
+    stat = os.stat(predictorfp)
+    return '{}:{}:{}'.format(os.path.basename(predictorfp), stat.st_size, int(stat.st_mtime))
+
+
+def cache_key(data, model, **params):
+    """cache_key finds the key under which the faces
+    of an image are stored.
+
+    **Parameters**
+    data: bytes
+        The raw bytes of the image file
+    model: str
+        The identity of the predictor model, see model_identity
+    params: keyword arguments
+        The detector parameters used, e.g. upsample=1
+
+    **Returns**
+    key: str
+        A hex digest identifying the image, model and parameters
+    """
+    key = hashlib.sha256(data)
+    key.update(model.encode())
+    key.update(json.dumps(params, sort_keys=True).encode())
+    return key.hexdigest()
+
+
+class LandmarkCache(object):
+    """LandmarkCache stores the faces found in an image
+    in an SQLite database. Each entry is a list of
+    (box, landmarks) pairs, which is empty for an
+    image in which no face was found.
+
+    **Parameters**
+    path: str
+        The filepath of the SQLite database. It is
+        created if it does not already exist.
+    max_entries: int
+        The number of images kept before the least recently
+        used ones are evicted. Default is 10000.
+    """
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path, timeout=30)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS faces '
+                                    '(key TEXT PRIMARY KEY, faces TEXT, last_used REAL)')
+
+    def get(self, key):
+        """get returns the faces stored under a key,
+        or None if the key is not in the cache.
+        """
+        row = self.connection.execute('SELECT faces FROM faces WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self.connection:
+            self.connection.execute('UPDATE faces SET last_used = ? WHERE key = ?', (time.time(), key))
+        return [(tuple(box), [tuple(point) for point in landmarks]) for box, landmarks in json.loads(row[0])]
+
+    def put(self, key, faces):
+        """put stores the faces of an image under a key and
+        evicts the least recently used entries if the cache
+        has grown past max_entries.
+        """
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO faces VALUES (?, ?, ?)',
+                                    (key, json.dumps(faces), time.time()))
+            self.connection.execute('DELETE FROM faces WHERE key IN (SELECT key FROM faces '
+                                    'ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def close(self):
+        """close closes the database connection"""
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,250 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# partial.py
+'''
+This script takes care of averaging a set of images split
+into shards, e.g. across machines. Each shard is averaged on
+its own into a partial, a file holding the sums of its warped
+faces and of their landmarks, the number of faces, and the
+template and triangulation they were warped to. Partials are
+merged by adding up their sums, which are integers in fixed
+point (see accumulator.py), so merging gives the same result
+in any order or grouping, and a merged partial can be merged
+again. The faces of every shard must be warped to the same
+template, so the run has two rounds:
+    1. Each shard makes a landmarks partial, which holds only
+       the landmark sums, and these are merged.
+    2. Each shard makes a faces partial, warped to the mean
+       landmarks of the merged landmarks partial, and these
+       are merged into the average face.
+It contains five functions:
+    save_partial
+    load_partial
+    shard_partial
+    merge_partials
+    partial_template
+
+Sources:
+    https://numpy.org/doc/stable/reference/generated/numpy.savez.html
+'''
+import os
+import argparse
+import numpy as np
+import cv2
+from models import PREDICTOR
+from ingest import ingest_images, load_image
+from scale import width, height, boundaryPts, eye_transforms, scale_landmarks
+from transform import calculateDelaunayTriangles
+from accumulator import FRACTION_BITS, FIXED, FaceAccumulator
+
+
+def save_partial(path, partial):
+    """save_partial saves a partial. It is written to a
+    temporary file first and then renamed, so readers never
+    see half a partial.
+
+    **Parameters**
+    path: str
+        The filepath of the partial
+    partial: dict
+        The partial, see load_partial
+
+    **Returns**
+    None
+    """
+    temp = path + '.tmp'
+    empty = np.zeros(0, np.int64)
+    with open(temp, 'wb') as f:
+        np.savez(f,
+                 count=partial['count'],
+                 landmark_sum=partial['landmark_sum'],
+                 image_sum=partial['image_sum'] if partial['image_sum'] is not None else empty,
+                 template=partial['template'] if partial['template'] is not None else np.zeros(0, np.float32),
+                 dt=np.array(partial['dt'], np.int32).reshape(-1, 3) if partial['dt'] is not None else empty,
+                 size=np.array(partial['size'], np.int32),
+                 fraction_bits=partial['fraction_bits'])
+    os.replace(temp, path)
+
+
+def load_partial(path):
+    """load_partial loads a partial.
+
+    **Parameters**
+    path: str
+        The filepath of the partial
+
+    **Returns**
+    partial: dict
+        'count', the number of faces; 'landmark_sum' and
+        'image_sum', the fixed point sums of their common space
+        landmarks and warped images; 'template' and 'dt', the
+        landmarks and triangulation the faces were warped to;
+        'size', the (width, height) of the common space; and
+        'fraction_bits', see accumulator.FRACTION_BITS. For a
+        landmarks partial, image_sum, template and dt are None.
+    """
+    with np.load(path) as data:
+        faces = data['image_sum'].size > 0
+        return {'count': int(data['count']),
+                'landmark_sum': data['landmark_sum'],
+                'image_sum': data['image_sum'] if faces else None,
+                'template': data['template'] if faces else None,
+                'dt': [tuple(int(k) for k in t) for t in data['dt']] if faces else None,
+                'size': tuple(int(k) for k in data['size']),
+                'fraction_bits': int(data['fraction_bits'])}
+
+
+def shard_partial(image_path, template=None, predictorfp=PREDICTOR, cache_path=None, workers=1,
+                  min_face=0.1, detector='hog', boxes=None, progress=None):
+    """shard_partial makes the partial of the images of a
+    filepath. Without a template it only finds the landmarks,
+    making a landmarks partial. With one, the faces are loaded
+    and warped to it one at a time, making a faces partial.
+
+    **Parameters**
+    image_path: str
+        A string indicating the filepath containing
+        the images of the shard
+    template: dict
+        The merged landmarks partial of all the shards, or any
+        partial whose template should be used, see
+        partial_template. Default is None.
+    predictorfp: str
+        The filepath name containing the predictor file
+    cache_path, workers, min_face, detector, boxes, progress:
+        See ingest.ingest_images
+
+    **Returns**
+    partial: dict
+        The partial of the shard, see load_partial. A shard
+        without faces gives a partial with a count of 0.
+    """
+    if template is not None:
+        # Checked before the slow part
+        pointsAvg, dt = partial_template(template)
+    records = ingest_images(image_path, predictorfp, cache_path, workers, keep_pixels=False,
+                            min_face=min_face, progress=progress, detector=detector, boxes=boxes,
+                            exit_if_few=False)
+    partial = {'count': len(records), 'landmark_sum': np.zeros((len(boundaryPts) + 68, 2), np.int64),
+               'image_sum': None, 'template': None, 'dt': None, 'size': (width, height),
+               'fraction_bits': FRACTION_BITS}
+    if template is None:
+        if records:
+            alllandmarks = [record.landmarks for record in records]
+            pointsNorm = scale_landmarks(None, alllandmarks, eye_transforms(alllandmarks))[1]
+            # Rounded face by face, as FaceAccumulator does
+            partial['landmark_sum'] = np.rint(np.float64(pointsNorm) * FIXED).astype(np.int64).sum(axis=0)
+        return partial
+    accumulator = FaceAccumulator(frozen=True)
+    accumulator.set_template(pointsAvg, dt)
+    if progress is not None:
+        progress.begin('averaging', 'Averaging faces...', len(records))
+    loaded, image = None, None
+    for done, record in enumerate(records, 1):
+        # The faces of an image are next to each other
+        if record.filename != loaded:
+            loaded, image = record.filename, load_image(record)
+        if image is not None:
+            accumulator.add(image, record.landmarks)
+        if progress is not None:
+            progress.update(done)
+    # Less any faces whose files could no longer be read
+    partial['count'] = accumulator.count
+    if accumulator.count:
+        partial['landmark_sum'] = accumulator.landmark_sum
+    partial.update(image_sum=accumulator.image_sum, template=accumulator.template, dt=accumulator.dt)
+    return partial
+
+
+def merge_partials(partials):
+    """merge_partials adds up any number of partials.
+
+    **Parameters**
+    partials: list
+        The partials, either all landmarks partials or all
+        faces partials warped to the same template
+
+    **Returns**
+    partial: dict
+        The merged partial
+    """
+    if not partials:
+        raise ValueError("There are no partials to merge.")
+    first = partials[0]
+    for partial in partials[1:]:
+        if partial['size'] != first['size'] or partial['fraction_bits'] != first['fraction_bits']:
+            raise ValueError("The partials were made with different settings.")
+        if (partial['image_sum'] is None) != (first['image_sum'] is None):
+            raise ValueError("Landmarks partials and faces partials cannot be merged together.")
+        if first['image_sum'] is not None and not (np.array_equal(partial['template'], first['template'])
+                                                   and partial['dt'] == first['dt']):
+            raise ValueError("The faces of the partials were warped to different templates.")
+    merged = dict(first)
+    merged['count'] = sum(partial['count'] for partial in partials)
+    merged['landmark_sum'] = np.sum([partial['landmark_sum'] for partial in partials], axis=0)
+    if first['image_sum'] is not None:
+        merged['image_sum'] = np.sum([partial['image_sum'] for partial in partials], axis=0)
+    return merged
+
+
+def partial_template(partial):
+    """partial_template returns the template to warp faces
+    to for a partial, i.e. its own template, or for a
+    landmarks partial, its mean landmarks.
+
+    **Parameters**
+    partial: dict
+        The partial
+
+    **Returns**
+    pointsAvg: numpy array
+        The (76, 2) template landmarks
+    dt: list
+        Their triangulation
+    """
+    if partial['template'] is not None:
+        return partial['template'], partial['dt']
+    if partial['count'] == 0:
+        raise ValueError("The partial has no faces to find a template from.")
+    pointsAvg = np.float32(partial['landmark_sum'] / (partial['count'] * (1 << partial['fraction_bits'])))
+    return pointsAvg, calculateDelaunayTriangles(pointsAvg)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Average the faces of a set of images split into shards.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    shard = commands.add_parser('shard', help='make the partial of a folder of images')
+    shard.add_argument('image_path', help='the folder containing the images of the shard')
+    shard.add_argument('--output', required=True, help='where to save the partial')
+    shard.add_argument('--template', metavar='PATH',
+                       help='the merged landmarks partial to warp the faces to; '
+                            'without it only a landmarks partial is made')
+    shard.add_argument('--workers', type=int, default=1, help='the number of processes used to find faces')
+    shard.add_argument('--cache', default='landmark_cache.db',
+                       help='the landmark cache database, or "" to disable it')
+    shard.add_argument('--detector', choices=('hog', 'haar', 'lbp'), default='hog', help='the face detector')
+    merge = commands.add_parser('merge', help='merge partials into another partial or the average face')
+    merge.add_argument('partials', nargs='+', help='the partials to merge')
+    merge.add_argument('--output', required=True,
+                       help='where to save the merged partial (.npz), or the average face (an image)')
+    args = parser.parse_args()
+    if args.command == 'shard':
+        template = load_partial(args.template) if args.template else None
+        partial = shard_partial(args.image_path, template, cache_path=args.cache or None,
+                                workers=args.workers, detector=args.detector)
+        save_partial(args.output, partial)
+        print("Saved the {} partial of {} faces to '{}'.".format(
+            'faces' if template is not None else 'landmarks', partial['count'], args.output))
+    else:
+        partial = merge_partials([load_partial(path) for path in args.partials])
+        if args.output.endswith('.npz'):
+            save_partial(args.output, partial)
+            print("Saved the merged partial of {} faces to '{}'.".format(partial['count'], args.output))
+        elif partial['image_sum'] is None:
+            print("Landmarks partials have no faces to average. Make faces partials with --template first.")
+        elif partial['count'] == 0:
+            print("The partials have no faces to average.")
+        else:
+            output = partial['image_sum'] / (partial['count'] * (1 << partial['fraction_bits']))
+            cv2.imwrite(args.output, np.uint8(np.clip(output, 0, 1) * 255))
+            print("Saved the average of {} faces to '{}'.".format(partial['count'], args.output))
@@ -0,0 +1,136 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# progress.py
+'''
+This script takes care of reporting how far the averager
+has got. Each stage of the program is printed as before, and
+can also be handed as an event, holding the stage, the number
+of images done out of the total and the time elapsed, to a
+listener, e.g. one that passes it on to the website. The time
+taken by each stage, and the peak memory use of the process by
+its end, are kept, so that slow or memory hungry stages can be
+found, along with counts such as the number of images and faces.
+It contains one class:
+    Progress
+
+Sources:
+    https://docs.python.org/3/library/time.html
+'''
+import time
+from metrics import peak_rss
+
+
+class Progress(object):
+    """Progress keeps track of the stage the averager is
+    in and of how many images that stage has done.
+
+    **Parameters**
+    listener: function
+        Called with an event, see Progress.event, whenever the
+        stage or the number of images done changes. Default is
+        None, which only prints the stages.
+    """
+
+    def __init__(self, listener=None):
+        self.listener = listener
+        self.started = time.time()
+        self.stage = None
+        self.done = 0
+        self.total = None
+        self.timings = {}
+        self.memory = {}
+        self.counts = {}
+        self._stage_started = None
+
+    def begin(self, stage, message, total=None):
+        """begin starts a new stage, ending the current one.
+
+        **Parameters**
+        stage: str
+            A short name for the stage, e.g. 'landmarks'
+        message: str
+            The message printed for the stage
+        total: int
+            The number of images the stage goes through,
+            if known. Default is None.
+
+        **Returns**
+        None
+        """
+        self._end_stage()
+        print(message)
+        self.stage = stage
+        self.done = 0
+        self.total = total
+        self._stage_started = time.time()
+        self._emit()
+
+    def update(self, done, total=None):
+        """update sets the number of images the current
+        stage has done.
+
+        **Parameters**
+        done: int
+            The number of images done so far
+        total: int
+            The number of images the stage goes through,
+            if it has become known. Default is None.
+
+        **Returns**
+        None
+        """
+        self.done = done
+        if total is not None:
+            self.total = total
+        self._emit()
+
+    def finish(self):
+        """finish ends the current stage and reports
+        that the averager is done.
+
+        **Parameters**
+        None
+
+        **Returns**
+        None
+        """
+        self._end_stage()
+        self.stage = 'done'
+        self._emit()
+
+    def event(self):
+        """event returns the state of the averager.
+
+        **Parameters**
+        None
+
+        **Returns**
+        event: dict
+            The stage, the images done and total (None if
+            not known), the seconds elapsed since the start,
+            the seconds taken by each finished stage, the
+            peak resident memory in bytes of the process by
+            the end of each finished stage (see
+            metrics.peak_rss), and the counts recorded so far
+        """
+        return {'stage': self.stage,
+                'done': self.done,
+                'total': self.total,
+                'elapsed': time.time() - self.started,
+                'timings': dict(self.timings),
+                'memory': dict(self.memory),
+                'counts': dict(self.counts)}
+
+    def _end_stage(self):
+        if self.stage is not None and self._stage_started is not None:
+            self.timings[self.stage] = time.time() - self._stage_started
+            self.memory[self.stage] = peak_rss()
+            self._stage_started = None
+
+    def _emit(self):
+        if self.listener is not None:
+            self.listener(self.event())
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,82 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_accumulator.py
+'''
+This script tests that removing a face from a FaceAccumulator
+takes away exactly what adding it put in.
+'''
+import numpy as np
+import pytest
+from benchmark import synthetic_images, synthetic_landmarks
+from accumulator import FaceAccumulator
+
+COUNT = 4
+IMAGES = synthetic_images(COUNT, 400, 300)
+LANDMARKS = synthetic_landmarks(COUNT, 400, 300)
+
+
+def test_remove_is_exact():
+    accumulator = FaceAccumulator()
+    for image, landmarks in zip(IMAGES, LANDMARKS):
+        accumulator.add(image, landmarks)
+    # The same faces but the last, warped to the same template
+    expected = FaceAccumulator(template=accumulator.template, frozen=True)
+    for image, landmarks in zip(IMAGES[:-1], LANDMARKS[:-1]):
+        expected.add(image, landmarks)
+    accumulator.remove(IMAGES[-1], LANDMARKS[-1])
+    assert accumulator.count == expected.count
+    assert np.array_equal(accumulator.image_sum, expected.image_sum)
+    assert np.array_equal(accumulator.landmark_sum, expected.landmark_sum)
+    assert np.array_equal(accumulator.result(), expected.result())
+
+
+def test_add_and_remove_all_is_empty():
+    accumulator = FaceAccumulator()
+    for image, landmarks in zip(IMAGES, LANDMARKS):
+        accumulator.add(image, landmarks)
+    for image, landmarks in zip(IMAGES[::-1], LANDMARKS[::-1]):
+        accumulator.remove(image, landmarks)
+    assert accumulator.count == 0
+    assert not accumulator.image_sum.any()
+    assert not accumulator.landmark_sum.any()
+
+
+def test_order_does_not_matter():
+    first = FaceAccumulator()
+    for image, landmarks in zip(IMAGES, LANDMARKS):
+        first.add(image, landmarks)
+    second = FaceAccumulator(template=first.template, frozen=True)
+    for image, landmarks in zip(IMAGES[::-1], LANDMARKS[::-1]):
+        second.add(image, landmarks)
+    assert np.array_equal(first.image_sum, second.image_sum)
+    assert np.array_equal(first.landmark_sum, second.landmark_sum)
+
+
+def test_duplicate_source_is_refused():
+    accumulator = FaceAccumulator()
+    accumulator.add(IMAGES[0], LANDMARKS[0], source=('a.jpg', 0))
+    with pytest.raises(ValueError):
+        accumulator.add(IMAGES[1], LANDMARKS[1], source=('a.jpg', 0))
+    assert accumulator.count == 1
+
+
+def test_rewarp_waits_for_every_source():
+    accumulator = FaceAccumulator(load=lambda source: IMAGES[source])
+    accumulator.add(IMAGES[0], LANDMARKS[0])
+    template = accumulator.template
+    # A face without a source cannot be warped again, so nothing is
+    accumulator.add(IMAGES[1], LANDMARKS[1], source=1)
+    assert accumulator.template is template
+    with pytest.raises(ValueError):
+        accumulator.rewarp()
+
+
+def test_rewarp_matches_a_fresh_average():
+    accumulator = FaceAccumulator(load=lambda source: IMAGES[source])
+    for source in range(COUNT):
+        accumulator.add(IMAGES[source], LANDMARKS[source], source=source)
+    accumulator.rewarp()
+    expected = FaceAccumulator(template=accumulator.template, frozen=True)
+    for image, landmarks in zip(IMAGES, LANDMARKS):
+        expected.add(image, landmarks)
+    assert np.array_equal(accumulator.image_sum, expected.image_sum)
@@ -0,0 +1,136 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_checkpoint.py
+'''
+This script tests that a checkpointed run that is stopped
+and resumed gives the same average as one that is not. The
+faces are made up, and found by looking them up rather than
+by a detector, so the dlib model is not needed.
+'''
+import os
+import cv2
+import numpy as np
+import pytest
+pytest.importorskip('dlib')
+import checkpoint
+from benchmark import synthetic_images, synthetic_landmarks
+
+COUNT = 6
+
+
+class Stop(Exception):
+    """Stands in for the run being killed"""
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    """A folder of made up images, whose faces are looked up"""
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    faces = {}
+    landmarks = synthetic_landmarks(COUNT, 200, 150)
+    for i, image in enumerate(synthetic_images(COUNT, 200, 150)):
+        name = 'face{}.png'.format(i)
+        cv2.imwrite(str(folder / name), np.uint8(image * 255))
+        faces[name] = [((0, 0, 200, 150), landmarks[i])]
+    calls = []
+
+    def detect_file(file, *args):
+        calls.append(file)
+        image = cv2.imread(file)
+        return image, faces.get(os.path.basename(file), []) if image is not None else []
+
+    monkeypatch.setattr(checkpoint, 'warm', lambda *args: None)
+    monkeypatch.setattr(checkpoint, 'detect_file', detect_file)
+    return folder, faces, calls
+
+
+def average(folder, path, resume=False):
+    return checkpoint.average_checkpointed(str(folder), str(path), resume, every=2)
+
+
+def test_resume_in_first_pass(folder, tmp_path, monkeypatch):
+    folder, faces, calls = folder
+    expected = average(folder, tmp_path / 'whole.npz')
+    found = checkpoint.detect_file
+
+    def stop_after_three(file, *args):
+        if len(calls) == 3:
+            raise Stop()
+        return found(file, *args)
+
+    monkeypatch.setattr(checkpoint, 'detect_file', stop_after_three)
+    del calls[:]
+    with pytest.raises(Stop):
+        average(folder, tmp_path / 'run.npz')
+    monkeypatch.setattr(checkpoint, 'detect_file', found)
+    del calls[:]
+    output = average(folder, tmp_path / 'run.npz', resume=True)
+    # Only the files not logged before are looked at again
+    assert len(calls) == COUNT - 3
+    assert np.array_equal(output, expected)
+
+
+def test_resume_in_second_pass(folder, tmp_path, monkeypatch):
+    folder, faces, calls = folder
+    expected = average(folder, tmp_path / 'whole.npz')
+    accumulator = checkpoint.FaceAccumulator
+
+    class Stopping(accumulator):
+        def add(self, image, landmarks, source=None):
+            if self.count == 3:
+                raise Stop()
+            accumulator.add(self, image, landmarks, source)
+
+    monkeypatch.setattr(checkpoint, 'FaceAccumulator', Stopping)
+    with pytest.raises(Stop):
+        average(folder, tmp_path / 'run.npz')
+    assert checkpoint.load_checkpoint(str(tmp_path / 'run.npz'))['warped'] == 2
+    monkeypatch.setattr(checkpoint, 'FaceAccumulator', accumulator)
+    del calls[:]
+    output = average(folder, tmp_path / 'run.npz', resume=True)
+    assert calls == []
+    assert np.array_equal(output, expected)
+
+
+def test_resume_after_a_cut_off_log_line(folder, tmp_path, monkeypatch):
+    folder, faces, calls = folder
+    expected = average(folder, tmp_path / 'whole.npz')
+    found = checkpoint.detect_file
+
+    def stop_after_three(file, *args):
+        if len(calls) == 3:
+            raise Stop()
+        return found(file, *args)
+
+    monkeypatch.setattr(checkpoint, 'detect_file', stop_after_three)
+    del calls[:]
+    with pytest.raises(Stop):
+        average(folder, tmp_path / 'run.npz')
+    # As if the run was killed while writing a line
+    with open(str(tmp_path / 'run.npz.log'), 'a') as f:
+        f.write('{"file": "')
+    monkeypatch.setattr(checkpoint, 'detect_file', found)
+    output = average(folder, tmp_path / 'run.npz', resume=True)
+    assert len(checkpoint.read_log(str(tmp_path / 'run.npz.log'))) == COUNT
+    assert np.array_equal(output, expected)
+
+
+def test_file_unreadable_in_second_pass_is_left_out(folder, tmp_path, monkeypatch):
+    folder, faces, calls = folder
+    expected = average(folder, tmp_path / 'whole.npz')
+    # A file whose faces are found, but that cannot be read when they are warped
+    extra = folder / 'extra.png'
+    extra.write_bytes((folder / 'face0.png').read_bytes())
+    faces['extra.png'] = faces['face0.png']
+    accumulator = checkpoint.FaceAccumulator
+
+    class Breaking(accumulator):
+        def __init__(self, *args, **kwargs):
+            extra.write_bytes(b'not an image')
+            accumulator.__init__(self, *args, **kwargs)
+
+    monkeypatch.setattr(checkpoint, 'FaceAccumulator', Breaking)
+    output = average(folder, tmp_path / 'run.npz')
+    assert np.array_equal(output, expected)
+    assert 'skipped' in checkpoint.read_log(str(tmp_path / 'run.npz.log'))[str(extra)]
@@ -0,0 +1,53 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_delaunay.py
+'''
+This script tests that calculateDelaunayTriangles finds the
+same triangles as looking up every vertex among the points
+one by one.
+'''
+import cv2
+import numpy as np
+from benchmark import synthetic_landmarks
+from scale import eye_transforms, scale_landmarks
+from transform import calculateDelaunayTriangles
+
+
+def brute_force(points, width=600, height=600):
+    """Finds the triangles with the nested loops the lookup replaced"""
+    subdiv = cv2.Subdiv2D((0, 0, width, height))
+    for p in points:
+        subdiv.insert((float(p[0]), float(p[1])))
+    triangles = []
+    for t in subdiv.getTriangleList():
+        pt = [(t[0], t[1]), (t[2], t[3]), (t[4], t[5])]
+        if not all(0 <= x <= width and 0 <= y <= height for x, y in pt):
+            continue
+        ind = []
+        for x, y in pt:
+            for k, p in enumerate(points):
+                if x == p[0] and y == p[1]:
+                    ind.append(k)
+                    break
+        if len(ind) == 3:
+            triangles.append(tuple(ind))
+    return triangles
+
+
+def test_landmarks():
+    alllandmarks = synthetic_landmarks(20, 400, 300)
+    pointsAvg = scale_landmarks(None, alllandmarks, eye_transforms(alllandmarks))[0]
+    points = np.float32(pointsAvg)
+    triangles = calculateDelaunayTriangles(points)
+    assert triangles == brute_force(points)
+    assert len(triangles) > len(points)
+
+
+def test_random_points():
+    points = np.float32(np.random.default_rng(0).uniform(0, 600, (400, 2)))
+    assert calculateDelaunayTriangles(points) == brute_force(points)
+
+
+def test_whole_and_negative_zero_coordinates():
+    points = np.float32([[0, 0], [-0.0, 599], [599, 0], [599, 599], [300, 300], [100, 450]])
+    assert calculateDelaunayTriangles(points) == brute_force(points)
@@ -0,0 +1,92 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_detect.py
+'''
+This script tests that detect_faces runs the detector on a
+scaled down copy of the image first, falls back to the full
+image when that finds nothing, and uses supplied boxes as
+they are. The detector is a stand in, so the dlib model is
+not needed, but detect imports dlib.
+'''
+import cv2
+import numpy as np
+import pytest
+pytest.importorskip('dlib')
+import detect
+import models
+
+
+class Box(object):
+    """A face box, as dlib's detector returns it"""
+
+    def __init__(self, left, top, right, bottom):
+        self.box = (left, top, right, bottom)
+
+    def left(self):
+        return self.box[0]
+
+    def top(self):
+        return self.box[1]
+
+    def right(self):
+        return self.box[2]
+
+    def bottom(self):
+        return self.box[3]
+
+
+class Detector(object):
+    """Finds a face only in images of a given width"""
+
+    def __init__(self, width):
+        self.width = width
+        self.calls = []
+
+    def __call__(self, image, upsample):
+        self.calls.append((image.shape[1], upsample))
+        return [Box(10, 20, 50, 60)] if image.shape[1] == self.width else []
+
+
+IMAGE = np.zeros((1600, 2000, 3), np.uint8)
+
+
+def test_scaled_down_image_is_searched_first(monkeypatch):
+    # The smallest face is 160 pixels, twice the detector window
+    detector = Detector(1000)
+    monkeypatch.setattr(detect, 'get_detector', lambda: detector)
+    assert detect.detect_faces(IMAGE, min_face=0.1) == [(20, 40, 100, 120)]
+    assert detector.calls == [(1000, 0)]
+
+
+def test_scaled_down_image_is_upsampled_before_the_full_image(monkeypatch):
+    detector = Detector(2000)
+    monkeypatch.setattr(detect, 'get_detector', lambda: detector)
+    assert detect.detect_faces(IMAGE, min_face=0.1, upsample=1) == [(10, 20, 50, 60)]
+    assert detector.calls == [(1000, 0), (1000, 1), (2000, 1)]
+
+
+def test_full_image_only_without_min_face(monkeypatch):
+    detector = Detector(2000)
+    monkeypatch.setattr(detect, 'get_detector', lambda: detector)
+    assert detect.detect_faces(IMAGE, min_face=None, upsample=0) == [(10, 20, 50, 60)]
+    assert detector.calls == [(2000, 0)]
+
+
+def test_small_image_is_not_scaled(monkeypatch):
+    detector = Detector(400)
+    monkeypatch.setattr(detect, 'get_detector', lambda: detector)
+    assert detect.detect_faces(np.zeros((300, 400, 3), np.uint8)) == [(10, 20, 50, 60)]
+    assert detector.calls == [(400, 1)]
+
+
+def test_boxes_are_used_as_they_are(monkeypatch):
+    monkeypatch.setattr(detect, 'get_detector', None)
+    assert detect.detect_faces(IMAGE, detector='boxes', boxes=[(1.0, 2, 3, 4.9)]) == [(1, 2, 3, 4)]
+    assert detect.detect_faces(IMAGE, detector='boxes') == []
+
+
+def test_cascades_need_opencv_4(monkeypatch):
+    monkeypatch.delattr(cv2, 'CascadeClassifier', raising=False)
+    monkeypatch.setattr(models, '_detectors', {})
+    with pytest.raises(RuntimeError, match='OpenCV 4'):
+        models.get_detector('haar')
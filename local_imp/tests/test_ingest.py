@@ -0,0 +1,99 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_ingest.py
+'''
+This script tests that images streamed in again after their
+faces were found are left out of the average if their files
+can no longer be read, and that finding faces in worker
+processes gives the same records as finding them one file
+at a time. The faces are made up, and found by looking them
+up, so the dlib model is not needed, but ingest imports dlib.
+'''
+import os
+import cv2
+import numpy as np
+import pytest
+pytest.importorskip('dlib')
+import ingest
+from ingest import FaceRecord, ingest_images, iter_images, load_image
+from benchmark import synthetic_images, synthetic_landmarks
+from scale import eye_transforms, iter_scaled_images, scale_landmarks
+from transform import calculateDelaunayTriangles, image_transform, parallel_image_transform
+
+COUNT = 4
+
+
+@pytest.fixture
+def records(tmp_path):
+    """The records of a folder of made up images, kept on disk"""
+    landmarks = synthetic_landmarks(COUNT, 200, 150)
+    records = []
+    for i, image in enumerate(synthetic_images(COUNT, 200, 150)):
+        file = str(tmp_path / 'face{}.png'.format(i))
+        cv2.imwrite(file, np.uint8(image * 255))
+        records.append(FaceRecord(file, None, (0, 0, 200, 150), landmarks[i]))
+    return records
+
+
+def test_removed_file_loads_as_none(records):
+    os.remove(records[0].filename)
+    assert load_image(records[0]) is None
+    assert load_image(records[0]._replace(region=(0, 0, 100, 100))) is None
+    assert load_image(records[1]).shape == (150, 200, 3)
+
+
+def test_removed_file_is_left_out_of_the_average(records):
+    alllandmarks = [record.landmarks for record in records]
+    tforms = eye_transforms(alllandmarks)
+    pointsAvg, pointsNorm = scale_landmarks(None, alllandmarks, tforms)
+    dt = calculateDelaunayTriangles(pointsAvg)
+    readable = list(iter_scaled_images(iter_images(records[1:]), tforms[1:]))
+    expected = image_transform(readable, pointsNorm[1:], pointsAvg, dt, engine='remap')
+    os.remove(records[0].filename)
+    output = image_transform(iter_scaled_images(iter_images(records), tforms), pointsNorm, pointsAvg, dt,
+                             engine='remap')
+    assert np.allclose(output, expected, atol=1e-6)
+    load = lambda i: None if i == 0 else readable[i - 1]
+    output = parallel_image_transform(load, pointsNorm, pointsAvg, dt, engine='remap', workers=2)
+    assert np.allclose(output, expected, atol=1e-6)
+
+
+@pytest.fixture
+def folder(records, tmp_path, monkeypatch):
+    """The folder of the records, with a file that is not an
+    image and a folder in it, and faces found by their boxes"""
+    (tmp_path / 'notes.txt').write_text('not an image')
+    (tmp_path / 'more').mkdir()
+    boxes = {os.path.basename(record.filename): [(i, 0, 200, 150)] for i, record in enumerate(records)}
+    landmarks = [record.landmarks for record in records]
+
+    def find_faces(image, predictorfp, min_face=0.1, detector='hog', boxes=None):
+        return [(tuple(box), landmarks[box[0]]) for box in boxes or []]
+
+    # Patched before the workers are forked, so they use them too
+    monkeypatch.setattr(ingest, 'find_faces', find_faces)
+    monkeypatch.setattr(ingest, 'warm', lambda *args: None)
+    return str(tmp_path), boxes
+
+
+@pytest.mark.parametrize('keep_pixels, roi', [(True, False), (False, False), (True, True), (False, True)])
+def test_parallel_matches_serial(folder, keep_pixels, roi):
+    folder, boxes = folder
+    serial = ingest_images(folder, keep_pixels=keep_pixels, roi=roi, detector='boxes', boxes=boxes)
+    parallel = ingest_images(folder, workers=2, keep_pixels=keep_pixels, roi=roi, detector='boxes', boxes=boxes)
+    assert len(serial) == COUNT
+    assert [record[:1] + record[2:] for record in parallel] == [record[:1] + record[2:] for record in serial]
+    for first, second in zip(parallel, serial):
+        assert (first.image is None) == (second.image is None)
+        if first.image is not None:
+            assert np.array_equal(first.image, second.image)
+
+
+def test_parallel_skips_files_gone_before_they_are_read_again(folder, monkeypatch):
+    folder, boxes = folder
+    gone = os.path.join(folder, 'face0.png')
+    imread = cv2.imread
+    monkeypatch.setattr(cv2, 'imread', lambda file, *args: None if file == gone else imread(file, *args))
+    records = ingest_images(folder, workers=2, detector='boxes', boxes=boxes)
+    assert sorted(record.filename for record in records) == sorted(
+        os.path.join(folder, 'face{}.png'.format(i)) for i in range(1, COUNT))
@@ -0,0 +1,73 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_landmark_cache.py
+'''
+This script tests the keys of the landmark cache and the
+eviction of its least recently used entries.
+'''
+import itertools
+import landmark_cache
+from landmark_cache import LandmarkCache, cache_key, model_identity
+
+FACES = [((1, 2, 3, 4), [(5, 6), (7, 8)])]
+
+
+def test_key_is_stable():
+    assert cache_key(b'image', 'model', upsample=1) == cache_key(b'image', 'model', upsample=1)
+
+
+def test_key_ignores_parameter_order():
+    assert cache_key(b'image', 'model', upsample=1, min_face=0.1) == \
+        cache_key(b'image', 'model', min_face=0.1, upsample=1)
+
+
+def test_key_changes_with_image_model_and_parameters():
+    keys = {cache_key(b'image', 'model', upsample=1),
+            cache_key(b'other', 'model', upsample=1),
+            cache_key(b'image', 'other', upsample=1),
+            cache_key(b'image', 'model', upsample=0),
+            cache_key(b'image', 'model', upsample=1, detector='haar')}
+    assert len(keys) == 5
+
+
+def test_model_identity_changes_with_the_file(tmp_path):
+    model = tmp_path / 'model.dat'
+    model.write_bytes(b'a')
+    before = model_identity(str(model))
+    model.write_bytes(b'ab')
+    assert model_identity(str(model)) != before
+
+
+def test_put_and_get(tmp_path):
+    cache = LandmarkCache(str(tmp_path / 'cache.db'))
+    assert cache.get('missing') is None
+    cache.put('key', FACES)
+    cache.put('none', [])
+    assert cache.get('key') == FACES
+    assert cache.get('none') == []
+    cache.close()
+
+
+def test_entries_persist(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = LandmarkCache(path)
+    cache.put('key', FACES)
+    cache.close()
+    cache = LandmarkCache(path)
+    assert cache.get('key') == FACES
+    cache.close()
+
+
+def test_least_recently_used_are_evicted(tmp_path, monkeypatch):
+    # A clock that always moves on, so no two uses tie
+    clock = itertools.count()
+    monkeypatch.setattr(landmark_cache.time, 'time', lambda: next(clock))
+    cache = LandmarkCache(str(tmp_path / 'cache.db'), max_entries=2)
+    cache.put('a', FACES)
+    cache.put('b', FACES)
+    assert cache.get('a') == FACES
+    cache.put('c', FACES)
+    assert cache.get('b') is None
+    assert cache.get('a') == FACES
+    assert cache.get('c') == FACES
+    cache.close()
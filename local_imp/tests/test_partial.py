@@ -0,0 +1,91 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_partial.py
+'''
+This script tests that merging the partials of shards gives
+the same sums in any order and grouping, and the same sums as
+averaging all the images as one shard. The faces are made up,
+so the dlib model is not needed, but partial imports dlib.
+'''
+import numpy as np
+import pytest
+pytest.importorskip('dlib')
+import partial
+from ingest import FaceRecord
+from benchmark import synthetic_images, synthetic_landmarks
+from partial import load_partial, merge_partials, partial_template, save_partial, shard_partial
+
+COUNT = 6
+IMAGES = synthetic_images(COUNT, 200, 150)
+LANDMARKS = synthetic_landmarks(COUNT, 200, 150)
+# The shards, by name, as the indices of their images
+SHARDS = {'a': [0, 1], 'b': [2, 3, 4], 'c': [5], 'empty': [], 'all': list(range(COUNT))}
+
+
+@pytest.fixture(autouse=True)
+def shards(monkeypatch):
+    """Finds the faces of a shard by looking them up"""
+    def ingest_images(image_path, *args, **kwargs):
+        return [FaceRecord('{}.png'.format(i), IMAGES[i], None, LANDMARKS[i]) for i in SHARDS[image_path]]
+
+    monkeypatch.setattr(partial, 'ingest_images', ingest_images)
+
+
+def assert_same(first, second):
+    assert first['count'] == second['count']
+    assert np.array_equal(first['landmark_sum'], second['landmark_sum'])
+    if first['image_sum'] is None:
+        assert second['image_sum'] is None
+    else:
+        assert np.array_equal(first['image_sum'], second['image_sum'])
+
+
+def test_landmarks_partials_merge_in_any_order():
+    a, b, c = (shard_partial(name) for name in 'abc')
+    merged = merge_partials([a, b, c])
+    assert_same(merged, merge_partials([merge_partials([c, a]), b]))
+    assert_same(merged, merge_partials([a, merge_partials([b, c])]))
+    assert_same(merged, shard_partial('all'))
+
+
+def test_faces_partials_merge_in_any_order():
+    template = merge_partials([shard_partial(name) for name in 'abc'])
+    a, b, c = (shard_partial(name, template) for name in 'abc')
+    merged = merge_partials([a, b, c])
+    assert merged['count'] == COUNT
+    assert_same(merged, merge_partials([merge_partials([b, c]), a]))
+    assert_same(merged, merge_partials([c, merge_partials([a, b])]))
+    assert_same(merged, shard_partial('all', template))
+
+
+def test_empty_shard_changes_nothing():
+    landmarks = merge_partials([shard_partial(name) for name in 'abc'])
+    assert_same(merge_partials([landmarks, shard_partial('empty')]), landmarks)
+    faces = merge_partials([shard_partial(name, landmarks) for name in 'abc'])
+    empty = shard_partial('empty', landmarks)
+    assert empty['count'] == 0
+    assert_same(merge_partials([empty, faces]), faces)
+    with pytest.raises(ValueError):
+        partial_template(shard_partial('empty'))
+
+
+def test_saved_partials_merge_the_same(tmp_path):
+    template = merge_partials([shard_partial(name) for name in 'abc'])
+    partials = [shard_partial(name, template) for name in 'abc']
+    for name, shard in zip('abc', partials):
+        save_partial(str(tmp_path / (name + '.npz')), shard)
+    loaded = [load_partial(str(tmp_path / (name + '.npz'))) for name in 'abc']
+    assert loaded[0]['dt'] == partials[0]['dt']
+    assert_same(merge_partials(loaded), merge_partials(partials))
+
+
+def test_partials_must_match():
+    landmarks = merge_partials([shard_partial(name) for name in 'abc'])
+    faces = shard_partial('a', landmarks)
+    other = shard_partial('b', shard_partial('b'))
+    with pytest.raises(ValueError):
+        merge_partials([landmarks, faces])
+    with pytest.raises(ValueError):
+        merge_partials([faces, other])
+    with pytest.raises(ValueError):
+        merge_partials([])
@@ -0,0 +1,51 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_similarity.py
+'''
+This script tests the closed form similarity transforms
+against OpenCV's estimate, and the batched transform of the
+landmarks against transforming them one image at a time.
+'''
+import math
+import cv2
+import numpy as np
+from benchmark import synthetic_landmarks
+from scale import eyecornerDst, eye_transforms, scale_landmarks
+from transform import similarity_transforms
+
+
+def third_point(points):
+    """Finds the point forming an equilateral triangle with
+    two others, as similarity_transform does, but unrounded"""
+    (x0, y0), (x1, y1) = points
+    s60, c60 = math.sin(math.pi / 3), math.cos(math.pi / 3)
+    return (c60 * (x0 - x1) - s60 * (y0 - y1) + x1, s60 * (x0 - x1) + c60 * (y0 - y1) + y1)
+
+
+def test_maps_the_pairs_exactly():
+    inPoints = np.random.default_rng(0).uniform(0, 1000, (50, 2, 2))
+    tforms = similarity_transforms(inPoints, eyecornerDst)
+    mapped = np.matmul(inPoints, tforms[:, :, :2].transpose(0, 2, 1)) + tforms[:, np.newaxis, :, 2]
+    assert np.allclose(mapped, np.broadcast_to(eyecornerDst, mapped.shape), atol=1e-9)
+    # No shear or reflection, only rotation, scale and translation
+    assert np.allclose(tforms[:, 0, 0], tforms[:, 1, 1])
+    assert np.allclose(tforms[:, 0, 1], -tforms[:, 1, 0])
+
+
+def test_matches_opencv():
+    inPoints = np.random.default_rng(1).uniform(0, 1000, (20, 2, 2))
+    tforms = similarity_transforms(inPoints, eyecornerDst)
+    outPts = list(eyecornerDst) + [third_point(eyecornerDst)]
+    for pair, tform in zip(inPoints, tforms):
+        inPts = [tuple(point) for point in pair] + [third_point(pair)]
+        expected = cv2.estimateAffinePartial2D(np.float64([inPts]), np.float64([outPts]))[0]
+        assert np.allclose(tform, expected, rtol=1e-6, atol=1e-4)
+
+
+def test_batched_landmarks_match_one_at_a_time():
+    alllandmarks = synthetic_landmarks(10, 400, 300)
+    tforms = eye_transforms(alllandmarks)
+    pointsNorm = scale_landmarks(None, alllandmarks, tforms)[1]
+    for landmarks, tform, points in zip(alllandmarks, tforms, pointsNorm):
+        expected = cv2.transform(np.float64([landmarks]), tform)[0]
+        assert np.allclose(points[:68], expected, atol=1e-3)
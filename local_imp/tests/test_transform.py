@@ -0,0 +1,60 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_transform.py
+'''
+This script tests that the warp engines of image_transform
+give the same average face, and that warping in parallel
+gives the same average face as warping one image at a time.
+'''
+import numpy as np
+import pytest
+from benchmark import synthetic_images, synthetic_landmarks
+from scale import eye_transforms, scale_images, scale_landmarks
+from transform import calculateDelaunayTriangles, image_transform, parallel_image_transform
+
+COUNT = 5
+
+
+def common_space(count=COUNT):
+    """Made up images and landmarks, scaled to the common space"""
+    images = synthetic_images(count, 400, 300)
+    alllandmarks = synthetic_landmarks(count, 400, 300)
+    tforms = eye_transforms(alllandmarks)
+    pointsAvg, pointsNorm = scale_landmarks(images, alllandmarks, tforms)
+    return scale_images(images, alllandmarks, tforms), pointsNorm, pointsAvg, calculateDelaunayTriangles(pointsAvg)
+
+
+def test_remap_matches_triangles():
+    scaled_images, pointsNorm, pointsAvg, dt = common_space()
+    remap = image_transform(scaled_images, pointsNorm, pointsAvg, dt, engine='remap')
+    triangle = image_transform(scaled_images, pointsNorm, pointsAvg, dt, engine='triangle')
+    # They differ only on triangle edges, which warpTriangle
+    # counts twice, and in how they interpolate
+    difference = np.abs(remap - triangle)
+    assert difference.mean() < 1e-4
+    assert difference.max() < 0.05
+
+
+def test_no_faces_is_an_error():
+    scaled_images, pointsNorm, pointsAvg, dt = common_space()
+    with pytest.raises(ValueError):
+        image_transform([], pointsNorm, pointsAvg, dt, engine='remap')
+
+
+@pytest.mark.parametrize('engine', ['remap', 'triangle'])
+def test_parallel_matches_serial(engine):
+    scaled_images, pointsNorm, pointsAvg, dt = common_space(7)
+    serial = image_transform(scaled_images, pointsNorm, pointsAvg, dt, engine=engine)
+    parallel = parallel_image_transform(scaled_images.__getitem__, pointsNorm, pointsAvg, dt, engine=engine,
+                                        workers=3)
+    assert np.allclose(parallel, serial, atol=1e-6)
+
+
+def fail(i):
+    raise OSError('image {} is gone'.format(i))
+
+
+def test_parallel_worker_error_is_raised():
+    scaled_images, pointsNorm, pointsAvg, dt = common_space()
+    with pytest.raises(OSError):
+        parallel_image_transform(fail, pointsNorm, pointsAvg, dt, engine='remap', workers=2)
@@ -0,0 +1,66 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# test_watch.py
+'''
+This script tests that a Watcher keeps the faces of a folder
+it briefly cannot read, and takes them out once the folder is
+gone. The faces are made up, and found by looking them up,
+so the dlib model is not needed, but watch imports dlib.
+'''
+import os
+import shutil
+import cv2
+import numpy as np
+import pytest
+pytest.importorskip('dlib')
+import watch
+from benchmark import synthetic_images, synthetic_landmarks
+
+COUNT = 3
+
+
+@pytest.fixture
+def watcher(tmp_path, monkeypatch):
+    """A Watcher of a folder of made up images, whose faces are looked up"""
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    faces = {}
+    landmarks = synthetic_landmarks(COUNT, 200, 150)
+    for i, image in enumerate(synthetic_images(COUNT, 200, 150)):
+        data = cv2.imencode('.png', np.uint8(image * 255))[1]
+        data.tofile(str(folder / 'face{}.png'.format(i)))
+        faces[data.tobytes()] = [((0, 0, 200, 150), landmarks[i])]
+
+    def detect_bytes(data, *args):
+        return cv2.imdecode(data, cv2.IMREAD_COLOR), faces.get(data.tobytes(), [])
+
+    monkeypatch.setattr(watch, 'detect_bytes', detect_bytes)
+    watcher = watch.Watcher([str(folder)], str(tmp_path / 'average.png'), str(tmp_path / 'spill'))
+    # Files are only added once they are the same on two scans
+    watcher.update()
+    watcher.update()
+    assert watcher.accumulator.count == COUNT
+    return watcher, folder
+
+
+def test_unreadable_folder_keeps_its_faces(watcher, monkeypatch):
+    watcher, folder = watcher
+
+    def scandir(path):
+        raise PermissionError(13, 'Permission denied', path)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(watch.os, 'scandir', scandir)
+        assert watcher.update() == 0
+    assert watcher.accumulator.count == COUNT
+    # Nothing is added again once it can be read
+    assert watcher.update() == 0
+    assert watcher.accumulator.count == COUNT
+
+
+def test_removed_folder_loses_its_faces(watcher):
+    watcher, folder = watcher
+    shutil.rmtree(str(folder))
+    assert watcher.update() == COUNT
+    assert watcher.accumulator.count == 0
+    assert watcher.files == {}
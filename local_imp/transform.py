@@ -3,24 +3,37 @@
 # transform.py
 '''
 This script takes care of the math behind the
-face averaging. It contains seven different functions:
+face averaging. It contains twelve different functions:
     similarity_transform
+    similarity_transforms
     rectContains
     calculateDelaunayTriangles
     constrainPoint
     applyAffineTransform
     warpTriangle
+    remap_plan
+    remap_warp
+    warp_image
     image_transform
+    parallel_image_transform
 
 Sources:
     1. https://docs.opencv.org/3.4/d4/d61/tutorial_warp_affine.html
     2. https://github.com/spmallick/learnopencv/tree/master/FaceAverage
     3. stack exchange
+    4. https://docs.python.org/3/library/multiprocessing.shared_memory.html
 '''
 import math
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import cv2
 import numpy as np
 
+# What the warp workers of parallel_image_transform need. It is
+# set before they are forked, so they inherit it without pickling.
+_shared = {}
+
 
 def similarity_transform(inPoints, outPoints):
     """ similarity_transform takes in a set of input points
@@ -67,6 +80,40 @@ def similarity_transform(inPoints, outPoints):
     return tform[0]
 
 
+def similarity_transforms(inPoints, outPoints):
+    """ similarity_transforms finds the similarity transforms
+    taking many pairs of input points to the same pair of
+    output points, all at once. A similarity transform is fixed
+    exactly by two point pairs, so rather than estimating it
+    like similarity_transform does, it is found in closed form
+    by treating the points as complex numbers: the transform is
+    z -> a*z + b with a = (w1 - w0) / (z1 - z0) and b = w0 - a*z0.
+
+    **Parameters**
+
+    inPoints: numpy array
+        An (N, 2, 2) array holding N pairs of input points
+    outPoints: list
+        A list of two tuples, the output point pair
+
+    **Returns**
+
+    tforms: numpy array
+        An (N, 2, 3) array of the N transforms, each in
+        the 2 x 3 form used by cv2.warpAffine
+    """
+    inPts = np.asarray(inPoints, np.float64)
+    outPts = np.asarray(outPoints, np.float64)
+    z = inPts[:, :, 0] + 1j * inPts[:, :, 1]
+    w = outPts[:, 0] + 1j * outPts[:, 1]
+    a = (w[1] - w[0]) / (z[:, 1] - z[:, 0])
+    b = w[0] - a * z[:, 0]
+    tforms = np.empty((len(inPts), 2, 3))
+    tforms[:, 0] = np.stack([a.real, -a.imag, b.real], axis=1)
+    tforms[:, 1] = np.stack([a.imag, a.real, b.imag], axis=1)
+    return tforms
+
+
 def rectContains(rect, point):
     """ rectContains checks if a
     rectangle contains a given point.
@@ -127,29 +174,26 @@ def calculateDelaunayTriangles(points, width=600, height=600):
     """
     rect = (0, 0, width, height)
     subdiv = cv2.Subdiv2D(rect)
-
-    for p in points:
-        subdiv.insert((p[0], p[1]))
-
-    triangleList = subdiv.getTriangleList()
-
-    delaunayTri = []
-    for t in triangleList:
-        pt = []
-        pt.append((t[0], t[1]))
-        pt.append((t[2], t[3]))
-        pt.append((t[4], t[5]))
-        pt1 = (t[0], t[1])
-        pt2 = (t[2], t[3])
-        pt3 = (t[4], t[5])
-        if rectContains(rect, pt1) and rectContains(rect, pt2) and rectContains(rect, pt3):
-            ind = []
-            for j in range(0, 3):
-                for k in range(0, len(points)):
-                    if(abs(pt[j][0] - points[k][0]) < 1.0 and abs(pt[j][1] - points[k][1]) < 1.0):
-                        ind.append(k)
-            if len(ind) == 3:
-                delaunayTri.append((ind[0], ind[1], ind[2]))
+    # Adding 0 turns any -0.0 into 0.0, so that equal coordinates
+    # also have equal bit patterns below
+    points = np.float32(points) + np.float32(0)
+    subdiv.insert([(float(p[0]), float(p[1])) for p in points])
+
+    triangleList = subdiv.getTriangleList().reshape(-1, 3, 2) + np.float32(0)
+    inside = np.all((triangleList[..., 0] >= rect[0]) & (triangleList[..., 0] <= rect[2]) &
+                    (triangleList[..., 1] >= rect[1]) & (triangleList[..., 1] <= rect[3]), axis=1)
+    triangleList = triangleList[inside]
+
+    # Subdiv2D hands back the exact float32 coordinates it was given,
+    # so each vertex is found by looking up the bits of its (x, y)
+    # pair among the sorted bits of the points.
+    keys = np.ascontiguousarray(points).view(np.uint64).ravel()
+    order = np.argsort(keys, kind='stable')
+    sortedKeys = keys[order]
+    vertexKeys = np.ascontiguousarray(triangleList).view(np.uint64).reshape(-1, 3)
+    found = np.minimum(np.searchsorted(sortedKeys, vertexKeys), len(keys) - 1)
+    matched = np.all(sortedKeys[found] == vertexKeys, axis=1)
+    delaunayTri = [tuple(int(k) for k in t) for t in order[found[matched]]]
     return delaunayTri
 
 
@@ -261,7 +305,154 @@ def warpTriangle(img1, img2, t1, t2):
     img2[r2[1]:r2[1]+r2[3], r2[0]:r2[0]+r2[2]] = img2[r2[1]:r2[1]+r2[3], r2[0]:r2[0]+r2[2]] + img2Rect
 
 
-def image_transform(scaled_images, pointsNorm, pointsAvg, dt, width=600, height=600):
+def remap_plan(pointsAvg, dt, width=600, height=600):
+    """remap_plan does the work of the remap warp engine
+    that only depends on the target landmarks, so that it is
+    done once rather than once per image. The target
+    triangulation is rasterized into a map holding, for every
+    output pixel, the index of the triangle covering it.
+
+    **Parameters**
+    pointsAvg: list
+        A list of tuples corresponding to the
+        average of all the coordinates of facial landmarks
+        from all the images in the original filepath
+    dt: list
+        A list of tuples corresponding to the triangles
+        from any Delaunay Triangulation of a given set
+        of image landmarks.
+    width: int
+        The desired ouput image width. Default is 600.
+    height: int
+        The desired output image height. Default is 600.
+
+    **Returns**
+    plan: dict
+        'index': the (height, width) index of the triangle
+            covering each output pixel, or -1 if none does
+        'triangle': index with -1 replaced by 0, so that it
+            can be used to look up per-triangle arrays
+        'outside': a (height, width) boolean mask of the
+            pixels no triangle covers
+        'inverse': the (len(dt), 3, 3) inverted matrices of
+            the target triangles, one row [x, y, 1] per corner
+        'dt': the triangles, as an (len(dt), 3) int32 array
+        'x', 'y': the (height, width) float32 coordinates of
+            each output pixel
+    """
+    dt = np.array(dt, np.int32).reshape(-1, 3)
+    points = np.array(pointsAvg, np.float32)
+    points[:, 0] = np.clip(points[:, 0], 0, width - 1)
+    points[:, 1] = np.clip(points[:, 1], 0, height - 1)
+    index = np.full((height, width), -1, np.int32)
+    for j in range(len(dt)):
+        # Vertices in 4 bit fixed point for sub-pixel accuracy
+        cv2.fillConvexPoly(index, np.int32(np.round(points[dt[j]] * 16)), j, 8, 4)
+    # Each row [x, y, 1] of a target triangle, inverted so that the
+    # affine map of any source triangle is a single matrix product
+    corners = np.concatenate([points[dt], np.ones((len(dt), 3, 1), np.float32)], axis=2)
+    inverse = np.linalg.pinv(np.float64(corners))
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    return {'index': index, 'triangle': np.maximum(index, 0), 'outside': index < 0,
+            'inverse': inverse, 'dt': dt, 'x': x, 'y': y}
+
+
+def remap_warp(image, points, plan, width=600, height=600):
+    """remap_warp warps a whole image to the target
+    landmarks of a remap_plan with a single cv2.remap.
+    The affine maps of all triangles are found at once,
+    and every output pixel is sampled through the map of
+    the triangle covering it.
+
+    **Parameters**
+    image: numpy array
+        A numpy array of the source image
+    points: list
+        A list of tuples corresponding to the
+        landmarks of the source image
+    plan: dict
+        The plan returned by remap_plan
+    width: int
+        The desired ouput image width. Default is 600.
+    height: int
+        The desired output image height. Default is 600.
+
+    **Returns**
+    dst: numpy array
+        A numpy array of the warped image
+    """
+    points = np.array(points, np.float64)
+    points[:, 0] = np.clip(points[:, 0], 0, width - 1)
+    points[:, 1] = np.clip(points[:, 1], 0, height - 1)
+    # (T, 3, 2) matrices taking [x, y, 1] in the target to the source
+    affine = np.matmul(plan['inverse'], points[plan['dt']]).astype(np.float32)
+    # One row per coefficient, so each is gathered with a flat take
+    coefficients = affine.reshape(-1, 6).T.copy()
+    tri = plan['triangle']
+    x, y = plan['x'], plan['y']
+    map_x = coefficients[0].take(tri) * x
+    map_x += coefficients[2].take(tri) * y
+    map_x += coefficients[4].take(tri)
+    map_y = coefficients[1].take(tri) * x
+    map_y += coefficients[3].take(tri) * y
+    map_y += coefficients[5].take(tri)
+    dst = cv2.remap(image, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT_101)
+    dst[plan['outside']] = 0
+    return dst
+
+
+def warp_image(image, points, pointsAvg, dt, plan=None, width=600, height=600):
+    """warp_image warps a single image from its own
+    landmarks to the average landmarks.
+
+    **Parameters**
+    image: numpy array
+        A numpy array of the scaled source image. uint8
+        images are converted to float32 in [0, 1] here.
+    points: list
+        A list of tuples corresponding to the
+        landmarks of the scaled source image
+    pointsAvg: list
+        A list of tuples corresponding to the
+        average of all the coordinates of facial landmarks
+    dt: list
+        A list of tuples corresponding to the triangles
+        from any Delaunay Triangulation of a given set
+        of image landmarks.
+    plan: dict
+        A plan from remap_plan. If given, the image is warped
+        with remap_warp, otherwise triangle by triangle.
+    width: int
+        The desired ouput image width. Default is 600.
+    height: int
+        The desired output image height. Default is 600.
+
+    **Returns**
+    img: numpy array
+        A numpy array of the warped image
+    """
+    if image.dtype == np.uint8:
+        image = np.float32(image)/255.0
+    if plan is not None:
+        return remap_warp(image, points, plan, width, height)
+    img = np.zeros((height, width, 3), np.float32())
+    # Transform triangles one by one
+    for j in range(0, len(dt)):
+        tin = []
+        tout = []
+        for k in range(0, 3):
+            pIn = points[dt[j][k]]
+            pIn = constrainPoint(pIn, width, height)
+            pOut = pointsAvg[dt[j][k]]
+            pOut = constrainPoint(pOut, width, height)
+            tin.append(pIn)
+            tout.append(pOut)
+        warpTriangle(image, img, tin, tout)
+    return img
+
+
+def image_transform(scaled_images, pointsNorm, pointsAvg, dt, width=600, height=600, engine='triangle',
+                    progress=None):
     """image_transform uses the helper functions above
     to actually transform specific images to a target space
 
@@ -270,9 +461,11 @@ def image_transform(scaled_images, pointsNorm, pointsAvg, dt, width=600, height=
 
     **Parameters**
     scaled_images: list
-        A list of tuples corresponding to the
-        coordinates of facial landmarks from
-        individual images scaled to a common space
+        A list of the individual images scaled to a common
+        space. Any iterable will do, so a generator can be
+        used to hold only one image in memory at a time.
+        An image that is None, e.g. one that could no longer
+        be read, is left out of the average.
     pointsNorm: list
         A list of tuples corresponding to the
         norm of all the coordinates of facial landmarks
@@ -289,34 +482,129 @@ def image_transform(scaled_images, pointsNorm, pointsAvg, dt, width=600, height=
         The desired ouput image width. Default is 600.
     height: int
         The desired output image height. Default is 600.
+    engine: str
+        How the images are warped. 'triangle' (the default) warps
+        them triangle by triangle with warpTriangle. 'remap' warps
+        each image with one cv2.remap, see remap_plan, which is
+        much faster and does not double count triangle edges.
+    progress: Progress
+        Told how many images are done after each one, see
+        progress.Progress. Default is None.
 
     **Returns**
     output: numpy array
         A numpy array corresponding to the final
-        face average image
+        face average image. ValueError is raised if
+        there are no images to average.
     """
     output = np.zeros((height, width, 3), np.float32())
-    for i in range(len(scaled_images)):
-        img = scaled_images[i]/len(scaled_images)
+    plan = remap_plan(pointsAvg, dt, width, height) if engine == 'remap' else None
     # Warp input images to average image landmarks
-    for i in range(0, len(scaled_images)):
-        img = np.zeros((height, width, 3), np.float32())
-        # Transform triangles one by one
-        for j in range(0, len(dt)):
-            tin = []
-            tout = []
-            for k in range(0, 3):
-                pIn = pointsNorm[i][dt[j][k]]
-                pIn = constrainPoint(pIn, width, height)
-                pOut = pointsAvg[dt[j][k]]
-                pOut = constrainPoint(pOut, width, height)
-                tin.append(pIn)
-                tout.append(pOut)
-            warpTriangle(scaled_images[i], img, tin, tout)
-        # Add image intensities for averaging
-        output += img
+    count = 0
+    for i, image in enumerate(scaled_images):
+        if image is not None:
+            # Add image intensities for averaging
+            output += warp_image(image, pointsNorm[i], pointsAvg, dt, plan, width, height)
+            count += 1
+        if progress is not None:
+            progress.update(i + 1, len(pointsNorm))
+    if count == 0:
+        raise ValueError("There are no faces to average.")
     # Divide by number of images to get average
-    output = output / len(scaled_images)
+    output = output / count
+    return output
+
+
+def _init_warp_worker(slots):
+    """Claims the partial sum buffer of a warp worker"""
+    with slots.get_lock():
+        _shared['slot'] = slots.value
+        slots.value += 1
+
+
+def _warp_chunk(indices):
+    """Warps some images inside a warp worker, adding
+    them to the worker's own partial sum buffer, and
+    returns how many were not None"""
+    if not 0 <= _shared['slot'] < len(_shared['sums']):
+        raise RuntimeError("Warp worker {} has no partial sum buffer.".format(_shared['slot']))
+    sums = _shared['sums'][_shared['slot']]
+    warped = 0
+    for i in indices:
+        image = _shared['load'](i)
+        if image is None:
+            continue
+        sums += warp_image(image, _shared['pointsNorm'][i], _shared['pointsAvg'], _shared['dt'],
+                           _shared['plan'], _shared['width'], _shared['height'])
+        warped += 1
+    return warped
+
+
+def parallel_image_transform(load, pointsNorm, pointsAvg, dt, width=600, height=600, engine='triangle',
+                             workers=2, progress=None):
+    """parallel_image_transform is image_transform spread
+    over a pool of worker processes. Each worker adds the
+    images it warps to its own partial sum, held in one
+    shared memory block, and the partial sums are added up
+    at the end, so no image or sum is ever pickled. The
+    workers are forked, so they share the images already
+    in memory. A worker that dies is not replaced, since
+    its partial sum is lost with it; the pool is broken
+    and BrokenProcessPool is raised instead. Where
+    processes cannot be forked, e.g. on Windows, it falls
+    back to image_transform.
+
+    **Parameters**
+    load: function
+        Called with the index of an image, returns the
+        image scaled to the common space, or None to leave
+        it out of the average
+    pointsNorm: list
+        See image_transform. There is one image per entry.
+    pointsAvg, dt, width, height, engine, progress:
+        See image_transform
+    workers: int
+        The number of worker processes. Default is 2.
+
+    **Returns**
+    output: numpy array
+        See image_transform
+    """
+    count = len(pointsNorm)
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print("Processes cannot be forked here, so the faces are warped one at a time.")
+        return image_transform((load(i) for i in range(count)), pointsNorm, pointsAvg, dt, width, height,
+                               engine, progress)
+    workers = max(1, min(workers, count))
+    block = shared_memory.SharedMemory(create=True, size=workers * height * width * 3 * 8)
+    try:
+        sums = np.ndarray((workers, height, width, 3), np.float64, buffer=block.buf)
+        sums[:] = 0
+        _shared.update(load=load, pointsNorm=pointsNorm, pointsAvg=pointsAvg, dt=dt, width=width, height=height,
+                       plan=remap_plan(pointsAvg, dt, width, height) if engine == 'remap' else None, sums=sums)
+        context = multiprocessing.get_context('fork')
+        # Small chunks, so that the workers finish at about the same time
+        size = max(1, min(16, count // (workers * 4)))
+        chunks = [range(start, min(start + size, count)) for start in range(0, count, size)]
+        done, warped = 0, 0
+        # Unlike multiprocessing.Pool, the executor never starts a
+        # worker in place of one that died, so there are only ever
+        # as many workers as partial sums
+        with ProcessPoolExecutor(workers, context, _init_warp_worker, (context.Value('i', 0),)) as pool:
+            futures = {pool.submit(_warp_chunk, chunk): len(chunk) for chunk in chunks}
+            for future in as_completed(futures):
+                warped += future.result()
+                done += futures[future]
+                if progress is not None:
+                    progress.update(done, count)
+        if warped == 0:
+            raise ValueError("There are no faces to average.")
+        output = np.float32(sums.sum(axis=0) / warped)
+        del sums
+    finally:
+        _shared.clear()
+        block.close()
+        block.unlink()
     return output
 
 
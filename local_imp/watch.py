@@ -0,0 +1,429 @@
+# Software Carpentry Final Project
+# Lincoln Kartchner
+# watch.py
+'''
+This script keeps an average face up to date while images
+are dropped into one or more folders. The folders are polled
+with os.scandir, and only files that are new, or whose size
+or modification time changed, are processed. Each face is
+added to a FaceAccumulator, so an update costs one warp per
+new face rather than a run over the whole folder. The output
+image is rewritten atomically, at most once per debounce
+interval. A copy of every file with a face is spilled to a
+separate folder, named by its contents, so that when a file
+changes or is removed, the face it contributed can be taken
+out of the average again exactly, even though the original is
+gone. Whenever the output is written, the table of processed
+files and the sums of the accumulator are saved to the spill
+folder too, so a restarted watcher carries on where it was,
+and copies no file refers to any more are deleted.
+It contains one function and one class:
+    atomic_write
+    Watcher
+
+Sources:
+    https://docs.python.org/3/library/os.html#os.scandir
+    https://docs.python.org/3/library/os.html#os.replace
+'''
+import os
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import cv2
+import numpy as np
+from models import PREDICTOR
+from ingest import detect_bytes
+from landmark_cache import LandmarkCache
+from accumulator import FaceAccumulator
+
+
+def atomic_write(path, image):
+    """atomic_write saves an image so that readers only
+    ever see the old file or the whole new one, by
+    writing a temporary file and renaming it over the path.
+
+    **Parameters**
+    path: str
+        The filepath of the image
+    image: numpy array
+        The uint8 image
+
+    **Returns**
+    None
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    temp = os.path.join(folder, '.{}.{}{}'.format(name, uuid.uuid4().hex, os.path.splitext(name)[1]))
+    if not cv2.imwrite(temp, image):
+        raise IOError("Couldn't write '{}'".format(temp))
+    os.replace(temp, path)
+
+
+class Watcher(object):
+    """Watcher keeps the average face of the images in a
+    set of folders.
+
+    **Parameters**
+    folders: list
+        The folders to watch
+    output_path: str
+        The filepath the average face is saved to
+    spill_path: str
+        The folder the copies of the processed files are kept
+        in. It is created if it does not already exist.
+    predictorfp: str
+        The filepath name containing the predictor file
+    cache_path: str
+        The filepath of the landmark cache database.
+        Default is None (no cache).
+    min_face: float
+        See detect.detect_faces. Default is 0.1.
+    detector: str
+        The face detector, see detect.DETECTORS. Default is 'hog'.
+    """
+
+    def __init__(self, folders, output_path, spill_path, predictorfp=PREDICTOR, cache_path=None,
+                 min_face=0.1, detector='hog'):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.output_path = os.path.abspath(output_path)
+        self.spill_path = spill_path
+        self.predictorfp = predictorfp
+        self.cache = LandmarkCache(cache_path) if cache_path else None
+        self.min_face = min_face
+        self.detector = detector
+        self.accumulator = FaceAccumulator(load=self._load)
+        # For each file processed: its (size, mtime), its spilled
+        # copy and the landmarks of its faces
+        self.files = {}
+        self.state_path = os.path.join(spill_path, 'state.npz')
+        # Files seen changing, with their (size, mtime) when last seen
+        self._settling = {}
+        # The modification time and the files of each folder
+        # when last scanned
+        self._listings = {}
+        os.makedirs(spill_path, exist_ok=True)
+        if os.path.exists(self.state_path):
+            self.load()
+        self.collect_spill()
+
+    def _load(self, source):
+        """Decodes the spilled copy of the file a face is from"""
+        path, index = source
+        image = cv2.imread(os.path.join(self.spill_path, self.files[path][1]))
+        return np.float32(image)/255.0
+
+    def _settings(self):
+        return {'predictor': os.path.abspath(self.predictorfp), 'min_face': self.min_face,
+                'detector': self.detector}
+
+    def save(self):
+        """save saves the table of processed files and the
+        sums of the accumulator to the spill folder. It is
+        written to a temporary file first and then renamed.
+
+        **Parameters**
+        None
+
+        **Returns**
+        None
+        """
+        accumulator = self.accumulator
+        landmark_sum, template, dt = np.zeros(0, np.int64), np.zeros(0, np.float32), np.zeros(0, np.int32)
+        if accumulator.landmark_sum is not None:
+            landmark_sum = accumulator.landmark_sum
+        if accumulator.template is not None:
+            template, dt = accumulator.template, np.array(accumulator.dt, np.int32).reshape(-1, 3)
+        temp = self.state_path + '.tmp'
+        with open(temp, 'wb') as f:
+            np.savez(f,
+                     settings=json.dumps(self._settings()),
+                     files=json.dumps(self.files),
+                     count=accumulator.count,
+                     image_sum=accumulator.image_sum,
+                     landmark_sum=landmark_sum,
+                     template=template,
+                     dt=dt,
+                     rewarped_at=accumulator._rewarped_at)
+        os.replace(temp, self.state_path)
+
+    def load(self):
+        """load restores the table of processed files and the
+        sums of the accumulator saved by save, unless they were
+        saved with other settings.
+
+        **Parameters**
+        None
+
+        **Returns**
+        loaded: bool
+            Whether the saved state was restored
+        """
+        with np.load(self.state_path) as data:
+            if json.loads(str(data['settings'])) != self._settings():
+                print("The saved state of '{}' is of other settings, so every image is processed again.".format(
+                    self.spill_path))
+                return False
+            self.files = {path: (tuple(stat), spill, [[tuple(point) for point in face] for face in faces])
+                          for path, (stat, spill, faces) in json.loads(str(data['files'])).items()}
+            accumulator = self.accumulator
+            if data['template'].size:
+                accumulator.set_template(data['template'], data['dt'])
+            accumulator.count = int(data['count'])
+            accumulator.image_sum = data['image_sum']
+            accumulator.landmark_sum = data['landmark_sum'] if data['landmark_sum'].size else None
+            accumulator._rewarped_at = int(data['rewarped_at'])
+            accumulator.sources = {(path, index): landmarks for path, (stat, spill, faces) in self.files.items()
+                                   for index, landmarks in enumerate(faces)}
+        print("Carrying on with the {} face(s) of {} file(s) processed before.".format(
+            accumulator.count, len(self.files)))
+        return True
+
+    def collect_spill(self):
+        """collect_spill deletes the spilled copies that no
+        processed file refers to any more, e.g. those left by
+        files that were removed.
+
+        **Parameters**
+        None
+
+        **Returns**
+        count: int
+            The number of copies deleted
+        """
+        keep = set(spill for stat, spill, faces in self.files.values())
+        keep.add(os.path.basename(self.state_path))
+        count = 0
+        for entry in os.scandir(self.spill_path):
+            if entry.is_file() and entry.name not in keep:
+                os.remove(entry.path)
+                count += 1
+        return count
+
+    def scan(self, full=True):
+        """scan lists the files that are new or changed, and
+        those that were removed, since the last scan. A file
+        is only listed once its size and modification time are
+        the same on two scans in a row, so that files still
+        being copied in are left alone.
+
+        **Parameters**
+        full: bool
+            If False, folders whose own modification time has
+            not changed are skipped. Files being added, renamed
+            or removed change it, files changed in place do not.
+            Default is True.
+
+        **Returns**
+        changed: list
+            The filepaths of the new or changed files
+        removed: list
+            The filepaths of the files that were removed.
+            The files of a folder that cannot be read are
+            only removed if the folder is gone.
+        """
+        current = {}
+        for folder in self.folders:
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+                if full or self._settling or self._listings.get(folder, (None,))[0] != mtime:
+                    listing = {}
+                    for entry in os.scandir(folder):
+                        # Hidden files include our own temporary output
+                        if entry.name.startswith('.') or entry.path == self.output_path or not entry.is_file():
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            # Removed while the folder was listed
+                            continue
+                        listing[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                    self._listings[folder] = (mtime, listing)
+            except FileNotFoundError:
+                print("The folder '{}' is gone.".format(folder))
+                self._listings.pop(folder, None)
+            except OSError:
+                # e.g. a network share that is briefly unavailable. Its
+                # files are kept until it can be read again.
+                print("Couldn't read the folder '{}'.".format(folder))
+            current.update(self._listings.get(folder, (None, {}))[1])
+        changed = []
+        for path, stat in current.items():
+            if path in self.files and self.files[path][0] == stat:
+                continue
+            if self._settling.get(path) == stat:
+                del self._settling[path]
+                changed.append(path)
+            else:
+                self._settling[path] = stat
+        removed = [path for path in self.files if path not in current]
+        for path in list(self._settling):
+            if path not in current:
+                del self._settling[path]
+        return sorted(changed), sorted(removed)
+
+    def remove(self, path):
+        """remove takes the faces of a file out of the average.
+
+        **Parameters**
+        path: str
+            The filepath of the file
+
+        **Returns**
+        count: int
+            The number of faces taken out
+        """
+        stat, spill, faces = self.files[path]
+        if faces:
+            image = self._load((path, 0))
+            for index, landmarks in enumerate(faces):
+                self.accumulator.remove(image, landmarks, (path, index))
+        # The copy is deleted by collect_spill once the table without
+        # the file has been saved
+        del self.files[path]
+        return len(faces)
+
+    def add(self, path):
+        """add adds the faces of a file to the average,
+        spilling a copy of the file first.
+
+        **Parameters**
+        path: str
+            The filepath of the file
+
+        **Returns**
+        count: int
+            The number of faces added
+        """
+        try:
+            stat = os.stat(path)
+            data = np.fromfile(path, np.uint8)
+        except OSError:
+            # Removed again before it could be read
+            return 0
+        image, faces = detect_bytes(data, self.predictorfp, self.cache, self.min_face, self.detector)
+        filename = os.path.basename(path)
+        if image is None:
+            print("'{}' could not be read as an image.".format(filename))
+        elif not faces:
+            print("Unable to detect a face in '{}'.".format(filename))
+        landmarks = [face_landmarks for box, face_landmarks in faces]
+        # Only files with faces are spilled, the others add nothing.
+        # Files with the same contents share one copy.
+        spill = None
+        if landmarks:
+            spill = hashlib.sha256(data).hexdigest()[:32] + os.path.splitext(path)[1].lower()
+            copy = os.path.join(self.spill_path, spill)
+            if not os.path.exists(copy):
+                temp = os.path.join(self.spill_path, '.{}.tmp'.format(uuid.uuid4().hex))
+                data.tofile(temp)
+                os.replace(temp, copy)
+            image = np.float32(image)/255.0
+        self.files[path] = ((stat.st_size, stat.st_mtime_ns), spill, landmarks)
+        for index, face_landmarks in enumerate(landmarks):
+            self.accumulator.add(image, face_landmarks, (path, index))
+        return len(landmarks)
+
+    def update(self, full=True):
+        """update scans the folders and brings the average
+        up to date with the files found.
+
+        **Parameters**
+        full: bool
+            See scan. Default is True.
+
+        **Returns**
+        changed: int
+            The number of files added, changed or removed
+        """
+        changed, removed = self.scan(full)
+        for path in removed:
+            count = self.remove(path)
+            print("Removed {} face(s) of '{}'.".format(count, os.path.basename(path)))
+        for path in changed:
+            if path in self.files:
+                self.remove(path)
+            count = self.add(path)
+            if count:
+                print("Added {} face(s) of '{}'.".format(count, os.path.basename(path)))
+        return len(changed) + len(removed)
+
+    def write(self):
+        """write saves the average face, if there are at
+        least two faces to average, and the state of the
+        watcher, see save.
+
+        **Parameters**
+        None
+
+        **Returns**
+        written: bool
+            Whether the average face was saved
+        """
+        self.save()
+        self.collect_spill()
+        if self.accumulator.count < 2:
+            print("Waiting for at least two faces...")
+            return False
+        output = self.accumulator.result()*255
+        atomic_write(self.output_path, output.astype('uint8'))
+        print("Saved the average of {} faces to '{}'.".format(self.accumulator.count, self.output_path))
+        return True
+
+    def run(self, interval=1.0, debounce=5.0, full_scan=60.0):
+        """run watches the folders until interrupted.
+
+        **Parameters**
+        interval: float
+            The seconds between scans. Default is 1.
+        debounce: float
+            The least seconds between two writes of the
+            average face. Default is 5.
+        full_scan: float
+            The seconds between scans of every folder, to find
+            files changed in place. In between, only folders
+            with files added, renamed or removed are scanned.
+            Default is 60.
+
+        **Returns**
+        None
+        """
+        print("Watching {} for images...".format(', '.join(self.folders)))
+        dirty = False
+        written = 0.0
+        scanned = 0.0
+        try:
+            while True:
+                now = time.time()
+                full = now - scanned >= full_scan
+                if full:
+                    scanned = now
+                dirty = self.update(full) > 0 or dirty
+                if dirty and now - written >= debounce:
+                    self.write()
+                    dirty = False
+                    written = now
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            if dirty:
+                self.write()
+        finally:
+            if self.cache is not None:
+                self.cache.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep the average face of the images in some folders.')
+    parser.add_argument('folders', nargs='+', help='the folders to watch')
+    parser.add_argument('--output', default='average_face.png', help='where to save the average face')
+    parser.add_argument('--spill', help='where to keep copies of the processed images, '
+                                        'default is a folder next to the output')
+    parser.add_argument('--cache', default='landmark_cache.db',
+                        help='the landmark cache database, or "" to disable it')
+    parser.add_argument('--detector', choices=('hog', 'haar', 'lbp'), default='hog', help='the face detector')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between scans')
+    parser.add_argument('--debounce', type=float, default=5.0, help='least seconds between writes of the output')
+    args = parser.parse_args()
+    watcher = Watcher(args.folders, args.output, args.spill or args.output + '.spill',
+                      cache_path=args.cache or None, detector=args.detector)
+    watcher.run(args.interval, args.debounce)